@@ -4,11 +4,16 @@ import sys
 from collections import OrderedDict
 import csv
 from zipfile import ZipFile
-from docx.api import Document
+
+from names import NameMatcher
+from docxtables import table_records
 
 
 name = {}
 
+# names which don't match exactly are matched once normalised, or by their trigrams
+matcher = NameMatcher()
+
 
 def load_names(prefix, path=None):
     if not path:
@@ -16,8 +21,10 @@ def load_names(prefix, path=None):
     for row in csv.DictReader(open(path)):
         organisation = prefix + ":" + row[prefix]
         name[row["name"].lower()] = organisation
+        matcher.add(row["name"], organisation)
         if "official-name" in row:
             name[row["official-name"].lower()] = organisation
+            matcher.add(row["official-name"], organisation)
 
 
 load_names("local-authority-eng")
@@ -43,22 +50,17 @@ fields = OrderedDict(
 w = csv.DictWriter(sys.stdout, fields.keys(), extrasaction="ignore")
 w.writeheader()
 
+# rows of the first table, streamed from the document inside the zip
 with ZipFile(sys.argv[1]) as z:
-    z.extract("addressbase-products-local-custodian-codes.docx", "collection")
-    document = Document("collection/addressbase-products-local-custodian-codes.docx")
-
-    table = document.tables[0]
-
-    keys = None
-    for i, row in enumerate(table.rows):
-        text = (cell.text for cell in row.cells)
-
-        if i == 0:
-            keys = tuple(text)
-            continue
-
-        o = dict(zip(keys, text))
-
+    for o in table_records(z.open("addressbase-products-local-custodian-codes.docx")):
         o["organisation"] = name.get(o["Authority"].lower(), "")
+        if not o["organisation"]:
+            o["organisation"] = matcher.best(o["Authority"]) or ""
+            if not o["organisation"]:
+                print(
+                    "no match for '%s', candidates: %s"
+                    % (o["Authority"], matcher.match(o["Authority"], 3)),
+                    file=sys.stderr,
+                )
 
         w.writerow({k: o[ok] for (k, ok) in fields.items()})
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+# time the organisation build and the ONS lookup joins over synthetic sources
+# made by scaling up the current ones, recording the results in a JSON history
+
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import argparse
+import logging
+import platform
+import resource
+import tempfile
+import subprocess
+from datetime import datetime
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import organisations
+import collect_ons_data
+
+# ONS lookups joined by collect_ons_data.py, along with the organisation sources
+lookup_paths = [dataset[2] for dataset in collect_ons_data.ons_datasets]
+
+# columns copied unchanged into each copy of a source,
+# every other column is an identifier and made distinct for each copy
+shared_columns = set(
+    [
+        "index-entry-number",
+        "entry-number",
+        "entry-timestamp",
+        "entry-date",
+        "type",
+        "p",
+        "opendatacommunities-type",
+        "dataset",
+        "prefix",
+        "local-authority-type",
+        "region-name",
+        "country-name",
+        "website",
+        "twitter",
+        "wikipedia",
+        "sitelink",
+        "boundary",
+        "census-area",
+    ]
+)
+
+
+def shared(column):
+    return column in shared_columns or column.endswith("-date")
+
+
+# write a copy of a source with each row repeated scale times
+def scale_csv(src, dst, scale):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    with open(src) as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = list(reader)
+
+    with open(dst, "w", newline="") as f:
+        w = csv.writer(f, lineterminator="\n")
+        w.writerow(header)
+        for n in range(scale):
+            suffix = "-%d" % (n) if n else ""
+            for row in rows:
+                w.writerow(
+                    [
+                        value if (not value or shared(column)) else value + suffix
+                        for column, value in zip(header, row)
+                    ]
+                )
+
+
+def generate(directory, scale):
+    for path in organisations.source_paths(organisations.stages) + lookup_paths:
+        scale_csv(path, os.path.join(directory, path), scale)
+
+
+# the build traces each read and stage, recorded along with the peak memory so far
+class Timer(organisations.Trace):
+    def __init__(self):
+        super().__init__(provenance=False)
+        self.stages = []
+
+    def event(self, name, start, **args):
+        self.stages.append(
+            {
+                "stage": name,
+                "seconds": round(time.perf_counter() - start, 6),
+                "max-rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            }
+        )
+
+    def time(self, name, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.event(name, start)
+        return result
+
+
+def run_build(timer):
+    built = organisations.build(trace=timer)
+    with open("collection/organisation.csv", "w", newline="") as f:
+        timer.time("save", organisations.save, built, f)
+    timer.time("validate", organisations.validate, built)
+    return built
+
+
+def run_lookups(timer):
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        run_joins(timer)
+
+
+def run_joins(timer):
+    load = collect_ons_data.get_csv_as_json
+    orgs = timer.time("load collection/organisation.csv", load, "collection/organisation.csv")
+    lrfs = timer.time("load data/local-resilience-forum.csv", load, "data/local-resilience-forum.csv")
+    regions = [
+        {"region": "region-" + code, "statistical-geography": code}
+        for code in sorted(set(r["region-statistical-geography"] for r in load("data/lookup/statistical-geography-la-to-region-lookup.csv")))
+    ]
+
+    tables = {"organisation": orgs, "local-resilience-forum": lrfs, "region": regions}
+    lookups = [
+        (lookup, [(field, column, tables[table]) for (field, column, table) in mappings])
+        for (lookup, mappings, output, patch) in collect_ons_data.identifier_lookups
+    ]
+    for lookup, mappings in lookups:
+        path = "data/lookup/%s.csv" % (lookup)
+        data = timer.time("load %s" % (path), load, path)
+        timer.time(
+            "map_statistical_geography_lookup %s" % (lookup),
+            collect_ons_data.map_statistical_geography_lookup,
+            data,
+            mappings,
+        )
+
+        # the same joins over DataFrames
+        frames = {id(table): pd.DataFrame(table) for (_, _, table) in mappings}
+        frame_mappings = [
+            (statistical_geography_field, field, frames[id(table)])
+            for (statistical_geography_field, field, table) in mappings
+        ]
+        timer.time(
+            "join_frame %s" % (lookup),
+            collect_ons_data.join_frame,
+            pd.DataFrame(data),
+            collect_ons_data.statistical_geography_joins(frame_mappings),
+            "left",
+            [mapping[0] for mapping in mappings],
+        )
+
+
+# run in a process of its own, so the peak memory is for this scale alone
+def run(root, scale):
+    directory = tempfile.mkdtemp(prefix="organisation-benchmark-")
+    try:
+        os.chdir(root)
+        generate(directory, scale)
+        os.chdir(directory)
+        os.makedirs("collection", exist_ok=True)
+
+        timer = Timer()
+        start = time.perf_counter()
+        built = run_build(timer)
+        run_lookups(timer)
+        return {
+            "scale": scale,
+            "organisations": len(built),
+            "seconds": round(time.perf_counter() - start, 6),
+            "max-rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "stages": timer.stages,
+        }
+    finally:
+        os.chdir(root)
+        shutil.rmtree(directory)
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.CRITICAL)
+
+    parser = argparse.ArgumentParser(description="benchmark the organisation build")
+    parser.add_argument(
+        "--scale",
+        type=int,
+        action="append",
+        help="times the size of the current sources, may be repeated (default 1, 10, 100 and 1000)",
+    )
+    parser.add_argument(
+        "--history",
+        default="benchmark/history.json",
+        help="file to append the results to",
+    )
+    args = parser.parse_args()
+
+    root = os.getcwd()
+    results = []
+    for scale in args.scale or [1, 10, 100, 1000]:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            result = executor.submit(run, root, scale).result()
+        print(
+            "%dx: %d organisations in %.3fs, max-rss %dKB"
+            % (scale, result["organisations"], result["seconds"], result["max-rss"]),
+            file=sys.stderr,
+        )
+        results.append(result)
+
+    history = []
+    if os.path.exists(args.history):
+        with open(args.history) as f:
+            history = json.load(f)
+
+    history.append(
+        {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": commit(),
+            "python": platform.python_version(),
+            "results": results,
+        }
+    )
+
+    os.makedirs(os.path.dirname(args.history) or ".", exist_ok=True)
+    with open(args.history, "w") as f:
+        json.dump(history, f, indent=2)
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+
+# find the organisation whose boundary contains each of any number of points:
+# the boundaries are indexed by a grid, each cell of which is known to be inside,
+# outside or on the boundary of each organisation it overlaps, so only points in cells
+# on a boundary are tested against its edges, a row of the grid at a time, with numpy
+
+import sys
+import csv
+import json
+import argparse
+import numpy as np
+from contextlib import redirect_stdout
+
+from csvload import read_records
+from lookup import OrganisationLookup
+from collect_ons_data import GeoJSONReader, detect_columns, iter_chunks, resolve
+
+organisation_csv = "collection/organisation.csv"
+
+# the number of point and edge pairs compared at once
+max_pairs = 1 << 20
+
+
+# the geometries of a GeoJSON document, which may be a FeatureCollection, Feature or geometry
+def document_geometries(document):
+    if document.get("type") == "FeatureCollection":
+        return [feature["geometry"] for feature in document["features"] if feature.get("geometry")]
+    if document.get("type") == "Feature":
+        return [document["geometry"]] if document.get("geometry") else []
+    return [document]
+
+
+# the polygons of a geometry, each a list of rings, the first being the outside
+def geometry_polygons(geometry):
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    if geometry["type"] == "MultiPolygon":
+        return geometry["coordinates"]
+    if geometry["type"] == "GeometryCollection":
+        return [p for g in geometry["geometries"] for p in geometry_polygons(g)]
+    return []
+
+
+def ring_area(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return abs(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1])) / 2
+
+
+# the edges of the rings of polygons, as an array of x0, y0, x1, y1 rows, and their area:
+# a point is inside where a ray from it crosses an odd number of edges
+def polygon_edges(polygons):
+    edges = []
+    area = 0.0
+    for polygon in polygons:
+        for i, ring in enumerate(polygon):
+            ring = np.asarray(ring, dtype=np.float64)[:, :2]
+            if len(ring) < 3:
+                continue
+            if (ring[0] != ring[-1]).any():
+                ring = np.vstack([ring, ring[:1]])
+            edges.append(np.hstack([ring[:-1], ring[1:]]))
+            area += ring_area(ring) * (-1 if i else 1)
+    if not edges:
+        return np.zeros((0, 4)), 0.0
+    return np.vstack(edges), area
+
+
+# whether each point is inside the edges, by the number of edges crossed by a ray along x
+def crossings(edges, px, py):
+    inside = np.zeros(len(px), dtype=bool)
+    step = max(1, max_pairs // max(1, len(edges)))
+    x0, y0, x1, y1 = (edges[:, i][None, :] for i in range(4))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for start in range(0, len(px), step):
+            x = px[start : start + step, None]
+            y = py[start : start + step, None]
+            spans = (y0 > y) != (y1 > y)
+            crossed = spans & (x < x0 + (y - y0) * (x1 - x0) / (y1 - y0))
+            inside[start : start + step] = np.count_nonzero(crossed, axis=1) % 2 == 1
+    return inside
+
+
+class BoundaryIndex:
+    # keys are the statistical geography codes of the boundaries, organisations the curies,
+    # and geometries the GeoJSON geometry of each, where boundaries overlap, such as a county
+    # and its districts, a point is given to the smallest boundary containing it
+    def __init__(self, keys, organisations, geometries, cells=1 << 18):
+        polygons = [polygon_edges(geometry_polygons(g)) for g in geometries]
+        order = sorted(
+            (i for i, (edges, area) in enumerate(polygons) if len(edges)),
+            key=lambda i: polygons[i][1],
+        )
+        self.keys = [keys[i] for i in order]
+        self.organisations = [organisations[i] for i in order]
+        self.edges = [polygons[i][0] for i in order]
+
+        if not self.edges:
+            raise ValueError("no boundaries to index")
+
+        # a grid of roughly square cells over every boundary
+        everything = np.vstack(self.edges)
+        self.x0 = min(everything[:, 0].min(), everything[:, 2].min())
+        self.y0 = min(everything[:, 1].min(), everything[:, 3].min())
+        width = max(everything[:, 0].max(), everything[:, 2].max()) - self.x0
+        height = max(everything[:, 1].max(), everything[:, 3].max()) - self.y0
+        size = max(np.sqrt(width * height / cells), max(width, height) / cells, 1e-9)
+        self.columns = int(width // size) + 1
+        self.rows = int(height // size) + 1
+        self.size = size
+
+        # the range of y of each edge, to pick out those which may cross a row of the grid
+        self.edge_rows = [
+            (
+                np.floor((np.minimum(e[:, 1], e[:, 3]) - self.y0) / self.size).astype(np.int64),
+                np.floor((np.maximum(e[:, 1], e[:, 3]) - self.y0) / self.size).astype(np.int64),
+            )
+            for e in self.edges
+        ]
+
+        # the cells of each boundary, with whether each is inside it or on its edges,
+        # ordered by cell, then by the size of the boundary
+        entries = []
+        for (n, edges) in enumerate(self.edges):
+            edge_cells = self.edge_cells(edges)
+            (c0, r0) = self.cell(edges[:, [0, 2]].min(), edges[:, [1, 3]].min())
+            (c1, r1) = self.cell(edges[:, [0, 2]].max(), edges[:, [1, 3]].max())
+            grid = (np.arange(r0, r1 + 1)[:, None] * self.columns + np.arange(c0, c1 + 1)[None, :]).ravel()
+            others = np.setdiff1d(grid, edge_cells, assume_unique=True)
+            centres_x = self.x0 + (others % self.columns + 0.5) * self.size
+            centres_y = self.y0 + (others // self.columns + 0.5) * self.size
+            inside = others[self.contains(n, centres_x, centres_y)]
+            entries.append(
+                np.column_stack(
+                    [
+                        np.concatenate([inside, edge_cells]),
+                        np.full(len(inside) + len(edge_cells), n),
+                        np.concatenate([np.ones(len(inside)), np.zeros(len(edge_cells))]),
+                    ]
+                ).astype(np.int64)
+            )
+        entries = np.vstack(entries)
+        entries = entries[np.lexsort((entries[:, 1], entries[:, 0]))]
+        self.entry_boundary = entries[:, 1].astype(np.int32)
+        self.entry_inside = entries[:, 2].astype(bool)
+        self.starts = np.searchsorted(entries[:, 0], np.arange(self.columns * self.rows + 1))
+
+    # current organisations with a boundary, from the boundary of each in the dataset,
+    # read from the cache of remote files
+    @classmethod
+    def from_organisations(cls, path=organisation_csv, offline=False, **kwargs):
+        keys, organisations, geometries = [], [], []
+        for row in read_records(path):
+            if not row["boundary"] or row["end-date"]:
+                continue
+            document = json.loads(resolve(row["boundary"], offline))
+            keys.append(row["statistical-geography"])
+            organisations.append(row["organisation"])
+            geometries.append({"type": "GeometryCollection", "geometries": document_geometries(document)})
+        return cls(keys, organisations, geometries, **kwargs)
+
+    # the features of a GeoJSON file of boundaries, such as those published by the ONS,
+    # with a column of statistical geography codes which may be named for any year, such as LADYYCD
+    @classmethod
+    def from_geojson(cls, path, column="LADYYCD", organisations=organisation_csv, **kwargs):
+        lookup = OrganisationLookup.from_csv(organisations)
+        keys, curies, geometries = [], [], []
+        columns = None
+        for feature in GeoJSONReader(iter_chunks(path)):
+            if columns is None:
+                columns = detect_columns(feature["properties"], [(column, column, False)])
+            code = feature["properties"].get(columns[column])
+            curie = lookup.resolve("statistical-geography", code)
+            if curie and feature.get("geometry"):
+                keys.append(code)
+                curies.append(curie)
+                geometries.append(feature["geometry"])
+        return cls(keys, curies, geometries, **kwargs)
+
+    # the column and row of the cell with a point
+    def cell(self, x, y):
+        return (
+            min(max(int((x - self.x0) // self.size), 0), self.columns - 1),
+            min(max(int((y - self.y0) // self.size), 0), self.rows - 1),
+        )
+
+    # every cell the bounding box of an edge overlaps
+    def edge_cells(self, edges):
+        c0 = np.floor((np.minimum(edges[:, 0], edges[:, 2]) - self.x0) / self.size).astype(np.int64)
+        c1 = np.floor((np.maximum(edges[:, 0], edges[:, 2]) - self.x0) / self.size).astype(np.int64)
+        r0 = np.floor((np.minimum(edges[:, 1], edges[:, 3]) - self.y0) / self.size).astype(np.int64)
+        r1 = np.floor((np.maximum(edges[:, 1], edges[:, 3]) - self.y0) / self.size).astype(np.int64)
+        c0, c1 = np.clip(c0, 0, self.columns - 1), np.clip(c1, 0, self.columns - 1)
+        r0, r1 = np.clip(r0, 0, self.rows - 1), np.clip(r1, 0, self.rows - 1)
+
+        widths = c1 - c0 + 1
+        counts = widths * (r1 - r0 + 1)
+        edge = np.repeat(np.arange(len(edges)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = (r0[edge] + offsets // widths[edge]) * self.columns + c0[edge] + offsets % widths[edge]
+        return np.unique(cells)
+
+    # whether each point is inside a boundary,
+    # testing the points in each row of the grid against the edges which reach the row
+    def contains(self, n, px, py):
+        inside = np.zeros(len(px), dtype=bool)
+        if not len(px):
+            return inside
+        edges = self.edges[n]
+        (low, high) = self.edge_rows[n]
+
+        rows = np.floor((py - self.y0) / self.size).astype(np.int64)
+        order = np.argsort(rows, kind="stable")
+        rows = rows[order]
+        bounds = np.flatnonzero(np.diff(rows)) + 1
+        for (start, end) in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(rows)]])):
+            row = rows[start]
+            reaching = edges[(low <= row) & (high >= row)]
+            points = order[start:end]
+            inside[points] = crossings(reaching, px[points], py[points])
+        return inside
+
+    # the position of the boundary containing each point, or -1
+    def locate_positions(self, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        found = np.full(len(x), -1, dtype=np.int32)
+
+        columns = np.floor((x - self.x0) / self.size)
+        rows = np.floor((y - self.y0) / self.size)
+        valid = (columns >= 0) & (columns < self.columns) & (rows >= 0) & (rows < self.rows)
+        pending = np.flatnonzero(valid)
+        cells = rows[pending].astype(np.int64) * self.columns + columns[pending].astype(np.int64)
+        starts = np.zeros(len(x), dtype=np.int64)
+        counts = np.zeros(len(x), dtype=np.int64)
+        starts[pending] = self.starts[cells]
+        counts[pending] = self.starts[cells + 1] - self.starts[cells]
+        pending = pending[counts[pending] > 0]
+
+        # the boundaries of the cell of each point, smallest first, until one contains it
+        k = 0
+        while len(pending):
+            entries = starts[pending] + k
+            boundaries = self.entry_boundary[entries]
+            inside = self.entry_inside[entries]
+            found[pending[inside]] = boundaries[inside]
+
+            tested = pending[~inside]
+            boundaries = boundaries[~inside]
+            order = np.argsort(boundaries, kind="stable")
+            tested, boundaries = tested[order], boundaries[order]
+            contained = np.zeros(len(tested), dtype=bool)
+            bounds = np.flatnonzero(np.diff(boundaries)) + 1
+            for (start, end) in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(tested)]])):
+                if start < end:
+                    points = tested[start:end]
+                    contained[start:end] = self.contains(int(boundaries[start]), x[points], y[points])
+            found[tested[contained]] = boundaries[contained]
+
+            k += 1
+            pending = tested[~contained]
+            pending = pending[counts[pending] > k]
+        return found
+
+    # the curie of the organisation, or statistical geography code with field="key",
+    # whose boundary contains each longitude and latitude, or None
+    def locate(self, longitude, latitude, field="organisation"):
+        values = np.array((self.keys if field == "key" else self.organisations) + [None], dtype=object)
+        return values[self.locate_positions(longitude, latitude)]
+
+    # the same for points given as eastings and northings of the British National Grid
+    def locate_osgb(self, easting, northing, field="organisation"):
+        return self.locate(*osgb36_to_wgs84(easting, northing), field=field)
+
+
+# the WGS84 longitude and latitude, in degrees, of eastings and northings of the British National Grid,
+# by the inverse transverse Mercator projection and a Helmert transformation, accurate to about 5m
+def osgb36_to_wgs84(easting, northing):
+    easting = np.asarray(easting, dtype=np.float64)
+    northing = np.asarray(northing, dtype=np.float64)
+
+    # Airy 1830 ellipsoid, and the National Grid projection
+    a, b = 6377563.396, 6356256.909
+    f0 = 0.9996012717
+    lat0, lon0 = np.radians(49.0), np.radians(-2.0)
+    n0, e0 = -100000.0, 400000.0
+    e2 = 1 - (b * b) / (a * a)
+    n = (a - b) / (a + b)
+
+    def meridional(lat):
+        return (
+            b
+            * f0
+            * (
+                (1 + n + 5 / 4 * n**2 + 5 / 4 * n**3) * (lat - lat0)
+                - (3 * n + 3 * n**2 + 21 / 8 * n**3) * np.sin(lat - lat0) * np.cos(lat + lat0)
+                + (15 / 8 * n**2 + 15 / 8 * n**3) * np.sin(2 * (lat - lat0)) * np.cos(2 * (lat + lat0))
+                - 35 / 24 * n**3 * np.sin(3 * (lat - lat0)) * np.cos(3 * (lat + lat0))
+            )
+        )
+
+    lat = np.full(easting.shape, lat0)
+    m = np.zeros(easting.shape)
+    for _ in range(20):
+        lat = (northing - n0 - m) / (a * f0) + lat
+        m = meridional(lat)
+        if np.all(np.abs(northing - n0 - m) < 1e-5):
+            break
+
+    sin, cos, tan = np.sin(lat), np.cos(lat), np.tan(lat)
+    nu = a * f0 / np.sqrt(1 - e2 * sin**2)
+    rho = a * f0 * (1 - e2) / (1 - e2 * sin**2) ** 1.5
+    eta2 = nu / rho - 1
+    sec = 1 / cos
+
+    vii = tan / (2 * rho * nu)
+    viii = tan / (24 * rho * nu**3) * (5 + 3 * tan**2 + eta2 - 9 * tan**2 * eta2)
+    ix = tan / (720 * rho * nu**5) * (61 + 90 * tan**2 + 45 * tan**4)
+    x = sec / nu
+    xi = sec / (6 * nu**3) * (nu / rho + 2 * tan**2)
+    xii = sec / (120 * nu**5) * (5 + 28 * tan**2 + 24 * tan**4)
+    xiia = sec / (5040 * nu**7) * (61 + 662 * tan**2 + 1320 * tan**4 + 720 * tan**6)
+
+    de = easting - e0
+    lat = lat - vii * de**2 + viii * de**4 - ix * de**6
+    lon = lon0 + x * de - xi * de**3 + xii * de**5 - xiia * de**7
+
+    # OSGB36 to WGS84, through cartesian coordinates
+    sin = np.sin(lat)
+    nu = a / np.sqrt(1 - e2 * sin**2)
+    cx = nu * np.cos(lat) * np.cos(lon)
+    cy = nu * np.cos(lat) * np.sin(lon)
+    cz = (1 - e2) * nu * sin
+
+    tx, ty, tz = 446.448, -125.157, 542.060
+    s = 1 - 20.4894e-6
+    rx, ry, rz = np.radians(np.array([0.1502, 0.2470, 0.8421]) / 3600)
+    wx = tx + s * cx - rz * cy + ry * cz
+    wy = ty + rz * cx + s * cy - rx * cz
+    wz = tz - ry * cx + rx * cy + s * cz
+
+    # GRS80 ellipsoid
+    a, b = 6378137.0, 6356752.314245
+    e2 = 1 - (b * b) / (a * a)
+    p = np.sqrt(wx**2 + wy**2)
+    lat = np.arctan2(wz, p * (1 - e2))
+    for _ in range(10):
+        nu = a / np.sqrt(1 - e2 * np.sin(lat) ** 2)
+        lat = np.arctan2(wz + e2 * nu * np.sin(lat), p)
+    return np.degrees(np.arctan2(wy, wx)), np.degrees(lat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="add the organisation whose boundary contains each point to CSV read from stdin"
+    )
+    parser.add_argument("x", help="column of longitudes, or eastings with --osgb")
+    parser.add_argument("y", help="column of latitudes, or northings with --osgb")
+    parser.add_argument("--osgb", action="store_true", help="points are British National Grid eastings and northings")
+    parser.add_argument("--geojson", help="GeoJSON file of boundaries, rather than the boundary of each organisation")
+    parser.add_argument("--column", default="LADYYCD", help="column of statistical geography codes in --geojson")
+    parser.add_argument("--organisations", default=organisation_csv, help="organisations with boundaries")
+    parser.add_argument("--offline", action="store_true", help="read boundaries from the cache alone")
+    parser.add_argument("--cells", type=int, default=1 << 18, help="number of cells in the grid")
+    args = parser.parse_args()
+
+    # report the boundaries read on stderr, keeping stdout for the points
+    with redirect_stdout(sys.stderr):
+        if args.geojson:
+            index = BoundaryIndex.from_geojson(args.geojson, args.column, args.organisations, cells=args.cells)
+        else:
+            index = BoundaryIndex.from_organisations(args.organisations, args.offline, cells=args.cells)
+
+    reader = csv.DictReader(sys.stdin)
+    rows = list(reader)
+    x = [float(row[args.x]) if row[args.x] else np.nan for row in rows]
+    y = [float(row[args.y]) if row[args.y] else np.nan for row in rows]
+    found = index.locate_osgb(x, y) if args.osgb else index.locate(x, y)
+
+    w = csv.writer(sys.stdout)
+    w.writerow(reader.fieldnames + ["organisation"])
+    for row, organisation in zip(rows, found):
+        w.writerow(list(row.values()) + [organisation or ""])
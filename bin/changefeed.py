@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+# the changes between two builds of the organisation dataset, as a feed of
+# added, removed and changed records with the fields which changed:
+# both builds are sorted by organisation, then read together in a merge-join,
+# so no more than a run of records from each is held in memory
+
+import io
+import sys
+import csv
+import json
+import heapq
+import argparse
+import subprocess
+from itertools import islice
+from operator import itemgetter
+from contextlib import contextmanager
+
+from csvload import save_run, read_run
+
+organisation_csv = "collection/organisation.csv"
+
+
+# open a file, or the file at a git revision given as <revision>:<path>
+@contextmanager
+def open_build(source, git=False):
+    if not git:
+        with open(source, newline="") as f:
+            yield f
+        return
+
+    process = subprocess.Popen(["git", "show", source], stdout=subprocess.PIPE)
+    try:
+        yield io.TextIOWrapper(process.stdout, encoding="utf-8", newline="")
+    finally:
+        process.stdout.close()
+        if process.wait():
+            raise ValueError("unable to read %s from git" % (source))
+
+
+# (organisation, record) pairs in order of organisation:
+# a build is sorted in runs of at most max_records, spilled to disk and merged,
+# as not every build has been written in order
+def records(f, key="organisation", max_records=100000):
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+        return
+    position = header.index(key)
+
+    rows = ((row[position], row) for row in reader)
+    runs = []
+    try:
+        for run in iter(lambda: list(islice(rows, max_records)), []):
+            runs.append(run if not runs and len(run) < max_records else save_run(run))
+
+        if len(runs) == 1 and isinstance(runs[0], list):
+            merged = sorted(runs[0], key=itemgetter(0))
+        else:
+            merged = heapq.merge(*[read_run(run) for run in runs], key=itemgetter(0))
+
+        for (organisation, row) in merged:
+            yield organisation, dict(zip(header, row))
+    finally:
+        for run in runs:
+            if not isinstance(run, list):
+                run.close()
+
+
+# (organisation, old, new) for every organisation in either build,
+# with None for a record missing from a build
+def merge_join(old, new):
+    old = iter(old)
+    new = iter(new)
+    o = next(old, None)
+    n = next(new, None)
+    while o is not None or n is not None:
+        if n is None or (o is not None and o[0] < n[0]):
+            yield (o[0], o[1], None)
+            o = next(old, None)
+        elif o is None or n[0] < o[0]:
+            yield (n[0], None, n[1])
+            n = next(new, None)
+        else:
+            yield (o[0], o[1], n[1])
+            o = next(old, None)
+            n = next(new, None)
+
+
+# (change, organisation, [(field, old value, new value), ...]) for each record which differs,
+# a field missing from a build having an empty value
+def diff(old, new):
+    for (organisation, o, n) in merge_join(old, new):
+        if o is None:
+            change = "added"
+        elif n is None:
+            change = "removed"
+        else:
+            change = "changed"
+        o = o or {}
+        n = n or {}
+
+        fields = list(dict.fromkeys(list(o) + list(n)))
+        changes = [
+            (field, o.get(field, ""), n.get(field, ""))
+            for field in fields
+            if o.get(field, "") != n.get(field, "")
+        ]
+        if changes:
+            yield (change, organisation, changes)
+
+
+# a row for each field which changed
+def save_csv(changes, f):
+    w = csv.writer(f)
+    w.writerow(["change", "organisation", "field", "old-value", "new-value"])
+    for (change, organisation, fields) in changes:
+        for (field, old, new) in fields:
+            w.writerow([change, organisation, field, old, new])
+
+
+# a JSON object for each record which changed
+def save_jsonl(changes, f):
+    for (change, organisation, fields) in changes:
+        f.write(
+            json.dumps(
+                {
+                    "change": change,
+                    "organisation": organisation,
+                    "fields": {field: {"old": old, "new": new} for (field, old, new) in fields},
+                }
+            )
+            + "\n"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="changes between two builds of the organisation dataset")
+    parser.add_argument("old", help="the earlier build, or a git revision with --git")
+    parser.add_argument("new", help="the later build, or a git revision with --git")
+    parser.add_argument(
+        "--git",
+        action="store_true",
+        help="compare the builds committed at two revisions",
+    )
+    parser.add_argument("--path", default=organisation_csv, help="the build within the repository, with --git")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv", help="format of the changes")
+    parser.add_argument(
+        "--max-records",
+        type=int,
+        default=100000,
+        help="sort each build in runs of at most this many records, merged from disk",
+    )
+    args = parser.parse_args()
+
+    old, new = args.old, args.new
+    if args.git:
+        old, new = "%s:%s" % (old, args.path), "%s:%s" % (new, args.path)
+
+    counts = {"added": 0, "removed": 0, "changed": 0}
+
+    def counted(changes):
+        for change in changes:
+            counts[change[0]] += 1
+            yield change
+
+    save = save_jsonl if args.format == "jsonl" else save_csv
+    with open_build(old, args.git) as o, open_build(new, args.git) as n:
+        changes = diff(records(o, max_records=args.max_records), records(n, max_records=args.max_records))
+        save(counted(changes), sys.stdout)
+
+    print("%(added)d added, %(removed)d removed, %(changed)d changed" % counts, file=sys.stderr)
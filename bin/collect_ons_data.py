@@ -1,107 +1,393 @@
 #!/usr/bin/env python3
 
 import os
+import re
+import sys
 import csv
 import json
+import time
+import codecs
+import hashlib
+import argparse
 import requests
-import pandas as pd
-from io import StringIO
-
-from cachecontrol import CacheControl
-from cachecontrol.caches.file_cache import FileCache
-
-
-# ONS datasets to collect
-local_resilience_forum_data = (
-    "Local Resilience Forums (December 2019) Names and Codes in England and Wales",
-    "https://opendata.arcgis.com/datasets/d81478eef3904c388091e40f4b344714_0.geojson",
-    "https://geoportal.statistics.gov.uk/datasets/local-resilience-forums-december-2019-names-and-codes-in-england-and-wales",
-    # fields we want to map
-    [
-        ("local-resilience-forum", "LRF19NM", True),
-        ("name", "LRF19NM", False),
-        ("statistical-geography", "LRF19CD", False),
-    ],
-    "data/local-resilience-forum.csv",
-)
-
-local_resilience_forum_local_authority_lookup = (
-    "Local Authority District to Local Resilience Forum (December 2019) Lookup in England and Wales",
-    "https://opendata.arcgis.com/datasets/203ea94d324b4fcda24875e83e577060_0.geojson",
-    "https://geoportal.statistics.gov.uk/datasets/local-authority-district-to-local-resilience-forum-december-2019-lookup-in-england-and-wales",
-    [
-        ("la-statistical-geography", "LAD19CD", False),
-        ("lrf-statistical-geography", "LRF19CD", False),
-    ],
-    "data/lookup/statistical-geography-la-to-lrf-lookup.csv",
-)
-
-local_authority_to_combined_authority_lookup = (
-    "Local Authority District to Combined Authority (December 2019) Lookup in England",
-    "https://opendata.arcgis.com/datasets/db4f8bae6bfa41babfafea3ec8a38c0e_0.geojson",
-    "https://geoportal.statistics.gov.uk/datasets/local-authority-district-to-combined-authority-december-2019-lookup-in-england",
-    [
-        ("la-statistical-geography", "LAD19CD", False),
-        ("comb-statistical-geography", "CAUTH19CD", False),
-    ],
-    "data/lookup/statistical-geography-la-to-comb-lookup.csv",
-)
-
-local_authority_to_region_lookup = (
-    "Local Authority District to Region (April 2019) Lookup in England",
-    "https://opendata.arcgis.com/datasets/3ba3daf9278f47daba0f561889c3521a_0.geojson",
-    "https://geoportal.statistics.gov.uk/datasets/local-authority-district-to-region-april-2019-lookup-in-england",
-    [
-        ("la-statistical-geography", "LAD19CD", False),
-        ("region-statistical-geography", "RGN19CD", False),
-    ],
-    "data/lookup/statistical-geography-la-to-region-lookup.csv",
-)
-
-
-datasets = [
-    local_resilience_forum_data,
-    local_resilience_forum_local_authority_lookup,
-    local_authority_to_combined_authority_lookup,
-    local_authority_to_region_lookup,
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+from csvload import parse_records, read_records, read_text
+
+
+# ONS datasets to collect: (name, fields, save path, vintages)
+# fields are (field, column, identifier) tuples, with the year of the codes in the name
+# of a column written as YY, such as LADYYCD, so the columns of any vintage are found.
+# vintages are (title, endpoint, documentation) tuples, oldest first, each a complete release,
+# so a boundary change is added as another vintage of the datasets it changes,
+# and the dataset is collected and built from its newest vintage alone,
+# leaving out the rows for areas which no longer exist
+ons_datasets = [
+    (
+        "local-resilience-forum",
+        [
+            ("local-resilience-forum", "LRFYYNM", True),
+            ("name", "LRFYYNM", False),
+            ("statistical-geography", "LRFYYCD", False),
+        ],
+        "data/local-resilience-forum.csv",
+        [
+            (
+                "Local Resilience Forums (December 2019) Names and Codes in England and Wales",
+                "https://opendata.arcgis.com/datasets/d81478eef3904c388091e40f4b344714_0.geojson",
+                "https://geoportal.statistics.gov.uk/datasets/local-resilience-forums-december-2019-names-and-codes-in-england-and-wales",
+            ),
+        ],
+    ),
+    (
+        "local-authority-to-local-resilience-forum",
+        [
+            ("la-statistical-geography", "LADYYCD", False),
+            ("lrf-statistical-geography", "LRFYYCD", False),
+        ],
+        "data/lookup/statistical-geography-la-to-lrf-lookup.csv",
+        [
+            (
+                "Local Authority District to Local Resilience Forum (December 2019) Lookup in England and Wales",
+                "https://opendata.arcgis.com/datasets/203ea94d324b4fcda24875e83e577060_0.geojson",
+                "https://geoportal.statistics.gov.uk/datasets/local-authority-district-to-local-resilience-forum-december-2019-lookup-in-england-and-wales",
+            ),
+        ],
+    ),
+    (
+        "local-authority-to-combined-authority",
+        [
+            ("la-statistical-geography", "LADYYCD", False),
+            ("comb-statistical-geography", "CAUTHYYCD", False),
+        ],
+        "data/lookup/statistical-geography-la-to-comb-lookup.csv",
+        [
+            (
+                "Local Authority District to Combined Authority (December 2019) Lookup in England",
+                "https://opendata.arcgis.com/datasets/db4f8bae6bfa41babfafea3ec8a38c0e_0.geojson",
+                "https://geoportal.statistics.gov.uk/datasets/local-authority-district-to-combined-authority-december-2019-lookup-in-england",
+            ),
+        ],
+    ),
+    (
+        "local-authority-to-region",
+        [
+            ("la-statistical-geography", "LADYYCD", False),
+            ("region-statistical-geography", "RGNYYCD", False),
+        ],
+        "data/lookup/statistical-geography-la-to-region-lookup.csv",
+        [
+            (
+                "Local Authority District to Region (April 2019) Lookup in England",
+                "https://opendata.arcgis.com/datasets/3ba3daf9278f47daba0f561889c3521a_0.geojson",
+                "https://geoportal.statistics.gov.uk/datasets/local-authority-district-to-region-april-2019-lookup-in-england",
+            ),
+        ],
+    ),
+]
+
+# lookups of statistical geography codes mapped to identifiers: (lookup, mappings, output, patch),
+# each mapping a (statistical geography field, field, table) tuple, where the field may be
+# a (field, new name) tuple, and the table names one of the tables loaded once for every lookup.
+# the patch adds rows missing from the ONS data
+identifier_lookups = [
+    (
+        "statistical-geography-la-to-lrf-lookup",
+        [
+            ("la-statistical-geography", "organisation", "organisation"),
+            ("lrf-statistical-geography", "local-resilience-forum", "local-resilience-forum"),
+        ],
+        "local-resilience-forum-to-local-authority",
+        None,
+    ),
+    (
+        "statistical-geography-la-to-comb-lookup",
+        [
+            ("comb-statistical-geography", ("organisation", "combined-authority"), "organisation"),
+            ("la-statistical-geography", "organisation", "organisation"),
+        ],
+        "local-authority-to-combined-authority",
+        None,
+    ),
+    (
+        "statistical-geography-la-to-region-lookup",
+        [
+            ("la-statistical-geography", "organisation", "organisation"),
+            ("region-statistical-geography", "region", "region"),
+        ],
+        "local-authority-to-region",
+        "region",
+    ),
 ]
 
 # pointers to remote datasets
-organisation_csv = os.environ.get(
-    "organisation_csv",
-    "https://raw.githubusercontent.com/digital-land/organisation-dataset/master/collection/organisation.csv",
-)
+organisation_csv_url = "https://raw.githubusercontent.com/digital-land/organisation-dataset/master/collection/organisation.csv"
+organisation_csv = os.environ.get("organisation_csv", organisation_csv_url)
 
 region_csv = "https://raw.githubusercontent.com/digital-land/region-collection/master/data/region.csv"
 
+# remote files built by this repository, read from the local build in preference
+local_copies = {
+    organisation_csv_url: "collection/organisation.csv",
+}
+
 
 def name_to_identifier(n):
     return n.lower().replace(" ", "-").replace(",", "")
 
 
-# cache files collected
-session = CacheControl(requests.session(), cache=FileCache(".cache"))
-
-
-def get(url):
-    r = session.get(url)
-    r.raise_for_status()
-    return r.text
-
-
-def get_csv_as_json(path_to_csv, cache=False):
-    if cache:
-        csv_str = get(path_to_csv)
-        csv_pd = pd.read_csv(StringIO(csv_str), sep=",")
+# files are cached by resolve, and collected datasets kept with their validators,
+# both making conditional requests of their own
+session = requests.session()
+
+# ETag and Last-Modified headers of the collected ONS datasets
+validators_path = ".cache/ons-validators.json"
+
+# remote files, stored by the SHA-256 of their content,
+# with the hash, validators and time each URL was last fetched kept in an index
+remote_cache_dir = ".cache/remote/"
+remote_index_path = remote_cache_dir + "index.json"
+
+
+# requests to these origins go through a pool of connections of their own,
+# large enough for the requests made to them at once
+def mount_origins(urls, pool_maxsize=10):
+    for origin in set(urljoin(url, "/") for url in urls):
+        session.mount(origin, HTTPAdapter(pool_maxsize=pool_maxsize))
+
+
+def load_remote_index():
+    if not os.path.exists(remote_index_path):
+        return {}
+    with open(remote_index_path) as f:
+        return json.load(f)
+
+
+def save_remote_index(index):
+    os.makedirs(remote_cache_dir, exist_ok=True)
+    with open(remote_index_path + ".tmp", "w") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(remote_index_path + ".tmp", remote_index_path)
+
+
+def remote_cache_path(entry):
+    return os.path.join(remote_cache_dir, entry["sha256"])
+
+
+# the text of a remote file: the copy built here, if there is one,
+# otherwise the cached copy while it is less than max_age seconds old,
+# refreshed with a conditional request once it is older.
+# offline, or when the request fails, the cached copy is used however old it is
+def resolve(url, offline=False, max_age=24 * 60 * 60):
+    local = local_copies.get(url, url)
+    if os.path.exists(local):
+        print(f"Read: {local}")
+        return read_text(local)
+
+    index = load_remote_index()
+    entry = index.get(url)
+    if entry and not os.path.exists(remote_cache_path(entry)):
+        entry = None
+    age = time.time() - entry["fetched"] if entry else None
+
+    if entry and (offline or age < max_age):
+        print(f"Read: {url}\nfrom cache, fetched {age / 3600:.1f} hours ago")
+        return read_text(remote_cache_path(entry))
+    if offline:
+        raise FileNotFoundError(f"{url} isn't cached, and can't be fetched offline")
+
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last-modified"):
+        headers["If-Modified-Since"] = entry["last-modified"]
+
+    mount_origins([url])
+    try:
+        r = session.get(url, headers=headers)
+        if r.status_code != 304:
+            r.raise_for_status()
+    except requests.RequestException as e:
+        if not entry:
+            raise
+        print(f"Read: {url}\nfrom cache, fetched {age / 3600:.1f} hours ago, as fetching failed: {e}")
+        return read_text(remote_cache_path(entry))
+
+    if r.status_code == 304:
+        print(f"Read: {url}\nfrom cache, not modified")
     else:
-        csv_pd = pd.read_csv(path_to_csv, sep=",")
-    return json.loads(csv_pd.to_json(orient="records"))
-
-
-def fetch_json_from_endpoint(endpoint):
-    json_url = requests.get(endpoint)
-    # should this check response is OK?
-    return json_url.json()
+        print(f"Fetched: {url}")
+        sha256 = hashlib.sha256(r.content).hexdigest()
+        entry = {"sha256": sha256}
+        path = remote_cache_path(entry)
+        if not os.path.exists(path):
+            os.makedirs(remote_cache_dir, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(r.content)
+            os.replace(path + ".tmp", path)
+        entry["etag"] = r.headers.get("ETag")
+        entry["last-modified"] = r.headers.get("Last-Modified")
+
+    entry["fetched"] = time.time()
+    index[url] = entry
+    save_remote_index(index)
+    return read_text(remote_cache_path(entry))
+
+
+# records of strings, with None for an empty cell
+def get_csv_as_json(path_to_csv, cache=False, offline=False, max_age=24 * 60 * 60):
+    if cache:
+        return parse_records(resolve(path_to_csv, offline, max_age), empty=None)
+    return read_records(path_to_csv, empty=None)
+
+
+# the body of a response, or contents of a local file, as chunks of bytes
+def iter_chunks(source, chunk_size=1 << 16):
+    if os.path.exists(source):
+        with open(source, "rb") as f:
+            yield from iter(lambda: f.read(chunk_size), b"")
+        return
+
+    with session.get(source, stream=True) as r:
+        r.raise_for_status()
+        yield from r.iter_content(chunk_size=chunk_size)
+
+
+# copy each chunk to a file as it passes through
+def tee_chunks(chunks, path):
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+            yield chunk
+
+
+# read the features of a GeoJSON FeatureCollection one at a time,
+# holding no more of the document in memory than the current feature:
+# the end of each value is found by scanning each chunk once as it arrives,
+# keeping track of strings and the depth of brackets, so a value is only
+# decoded once it is complete. the brackets of each kind are balanced within a value,
+# so only those of the kind it opens with are counted, and the coordinates
+# of a feature, being arrays, are passed over without stopping
+class GeoJSONReader:
+    whitespace = " \t\n\r"
+
+    # the rest of a string, stopping at its closing quote, or at an escape
+    # split across chunks
+    string_body = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+    structure = {"{": re.compile(r'["{}]'), "[": re.compile(r'["\[\]]'), '"': re.compile(r'"')}
+    scalar_end = re.compile(r"[,:}\]\s]")
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def more(self):
+        if self.eof:
+            raise ValueError("unexpected end of GeoJSON document")
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            text = self.utf8.decode(b"", final=True)
+        else:
+            text = self.utf8.decode(chunk)
+        self.buffer = self.buffer[self.pos :] + text
+        self.pos = 0
+
+    # the next character which isn't whitespace, or a separator
+    def peek(self, skip=""):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in self.whitespace + skip:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            self.more()
+
+    def expect(self, c):
+        if self.peek() != c:
+            raise ValueError("expected '%s' in GeoJSON document, found '%s'" % (c, self.buffer[self.pos]))
+        self.pos += 1
+
+    # the text of the next value, the text read so far being kept as parts
+    # so the buffer only ever holds the current chunk
+    def raw(self):
+        parts = []
+        if self.peek() not in '"{[':
+            # a scalar isn't complete until the character which follows it is read
+            while True:
+                m = self.scalar_end.search(self.buffer, self.pos)
+                if m:
+                    parts.append(self.buffer[self.pos : m.start()])
+                    self.pos = m.start()
+                    return "".join(parts)
+                parts.append(self.buffer[self.pos :])
+                self.pos = len(self.buffer)
+                self.more()
+
+        structure = self.structure[self.buffer[self.pos]]
+        depth = 0
+        in_string = False
+        i = self.pos
+        while True:
+            buffer = self.buffer
+            if in_string:
+                i = self.string_body.match(buffer, i).end()
+                if i == len(buffer) or buffer[i] == "\\":
+                    parts.append(buffer[self.pos : i])
+                    self.pos = i
+                    self.more()
+                    i = self.pos
+                    continue
+                i += 1
+                in_string = False
+            else:
+                m = structure.search(buffer, i)
+                if m is None:
+                    parts.append(buffer[self.pos :])
+                    self.pos = len(buffer)
+                    self.more()
+                    i = self.pos
+                    continue
+                i = m.end()
+                if m.group() == '"':
+                    in_string = True
+                    continue
+                depth += 1 if m.group() in "{[" else -1
+
+            if depth == 0:
+                parts.append(buffer[self.pos : i])
+                self.pos = i
+                return "".join(parts)
+
+    def value(self):
+        return json.loads(self.raw())
+
+    # the features, decoded by value, or as text by raw
+    def features(self, value):
+        self.expect("{")
+        while self.peek(",") != "}":
+            key = self.value()
+            self.expect(":")
+            if key != "features":
+                self.raw()
+                continue
+
+            self.expect("[")
+            while self.peek(",") != "]":
+                yield value()
+            self.pos += 1
+        self.pos += 1
+
+    def __iter__(self):
+        return self.features(self.value)
+
+    # the text of each feature, found without decoding it
+    def raw_features(self):
+        return self.features(self.raw)
 
 
 # write json to csv file
@@ -129,31 +415,89 @@ def json_to_csv_file(output_file, data):
     data_file.close()
 
 
-def join_col(d1, idx_d2, k, col):
-    for row in d1:
-        if row[k] is not None:
-            if idx_d2.get(row[k]) is not None:
-                row[col] = idx_d2[row[k]][col]
+# indexes of the tables joined to, built once for each table and key,
+# so a table is treated as unchanging once it has been joined to
+table_indexes = {}
+
+
+# index the rows of a table by a key, the last row with a value of the key is used
+def index_table(table, key):
+    cached = table_indexes.get((id(table), key))
+    if cached is None or cached[0] is not table:
+        idx = {}
+        for row in table:
+            idx[row.get(key)] = row
+        cached = table_indexes[(id(table), key)] = (table, idx)
+    return cached[1]
+
+
+# the same index of a DataFrame, as a Series of the values of a column
+def index_frame(frame, key, column):
+    cached = table_indexes.get((id(frame), key, column))
+    if cached is None or cached[0] is not frame:
+        series = frame.dropna(subset=[key]).drop_duplicates(key, keep="last")
+        cached = table_indexes[(id(frame), key, column)] = (
+            frame,
+            series.set_index(key)[column],
+        )
+    return cached[1]
+
+
+def check_how(how):
+    if how not in ("left", "inner"):
+        raise ValueError("unknown join '%s', expected 'left' or 'inner'" % (how))
+
+
+# join each row to the tables in a single pass, making a new row:
+# joins are (field, table, key, column, name) tuples, where the value of the field
+# is looked up by the key of the table, and the column of the row found added as name.
+# a left join gives None for a missing value, an inner join drops the row,
+# fields listed in drop are left out of the new rows
+def join(rows, joins, how="left", drop=()):
+    check_how(how)
+    lookups = [
+        (field, key, index_table(table, key), column, name)
+        for (field, table, key, column, name) in joins
+    ]
+    drop = set(drop)
+
+    joined = []
+    for row in rows:
+        entry = {field: value for field, value in row.items() if field not in drop}
+        complete = True
+        for (field, key, idx, column, name) in lookups:
+            value = row.get(field)
+            match = idx.get(value) if value is not None else None
+            if match is None:
+                if value is not None:
+                    print(f"no match for '{key}'", value)
+                entry[name] = None
             else:
-                print(f"no match for '{k}'", row[k])
-                row[col] = None
-    return d1
+                entry[name] = match.get(column)
+            complete = complete and entry[name] is not None
+
+        if complete or how == "left":
+            joined.append(entry)
+    return joined
 
 
-def joiner(d1, d2, k, cols):
-    if k in d1[0].keys() and k in d2[0].keys():
-        # index d2 by key
-        d2_idx = {x[k]: x for x in d2}
+# the same join of a DataFrame to other DataFrames, a column at a time
+def join_frame(frame, joins, how="left", drop=()):
+    check_how(how)
+    joined = frame.drop(columns=list(drop))
+    complete = None
+    for (field, table, key, column, name) in joins:
+        joined[name] = frame[field].map(index_frame(table, key, column))
+        found = joined[name].notna()
+        complete = found if complete is None else complete & found
 
-        for col in cols:
-            if col in d2[0].keys():
-                d1 = join_col(d1, d2_idx, k, col)
-    return d1
+    if how == "inner" and complete is not None:
+        joined = joined[complete].reset_index(drop=True)
+    return joined
 
 
-def save_geojson(data, filename):
-    with open(f"collection/{filename}.geojson", "w") as f:
-        json.dump(data, f)
+def geojson_path(filename):
+    return f"collection/{filename}.geojson"
 
 
 def extract_name_from_document_url(url):
@@ -162,92 +506,224 @@ def extract_name_from_document_url(url):
 
 # pass list of tuples
 # (desired field name, current field name, identifier(BOOL))
-def map_fields(d, field_tuples):
+# and the column found for each current field name, if it names a column of any vintage
+def map_fields(d, field_tuples, columns={}):
     entry = {}
     for (field, current, k) in field_tuples:
-        entry[field] = d.get(current)
+        entry[field] = d.get(columns.get(current, current))
         if k:
-            entry[field] = name_to_identifier(d.get(current))
+            entry[field] = name_to_identifier(entry[field])
     return entry
 
 
-def collect_geojson(name, endpoint, filename, fields):
-    print(f"Collect: {name}\nfrom: {endpoint}")
-    d = fetch_json_from_endpoint(endpoint)
-    # save_geojson(d, extract_name_from_document_url(region_data[2]))
-    save_geojson(d, filename)
-    entries = [map_fields(r["properties"], fields) for r in d["features"]]
-    return entries
-
-
-def rename_field(data, _from, to):
-    for d in data:
-        d[to] = d[_from]
-        d.pop(_from)
-    return data
+def column_pattern(column):
+    return re.compile("^" + re.escape(column).replace("YY", r"(\d\d)") + "$", re.IGNORECASE)
 
 
-def remove_field(data, field):
-    for d in data:
-        if field in d.keys():
-            del d[field]
-    return data
+# the column of the properties of a feature for each field,
+# YY matching the two digits of the year of the codes, the latest year where there are several
+def detect_columns(properties, field_tuples):
+    columns = {}
+    for (field, current, k) in field_tuples:
+        pattern = column_pattern(current)
+        found = sorted(
+            (match.groups()[0] if match.groups() else "", column)
+            for (match, column) in ((pattern.match(column), column) for column in properties)
+            if match
+        )
+        if not found:
+            raise KeyError("no column matching '%s' in %s" % (current, ", ".join(properties)))
+        columns[current] = found[-1][1]
+    return columns
+
+
+# the fields of each feature of a collected GeoJSON file, from the columns of its vintage
+def read_features(path, fields):
+    columns = None
+    for feature in GeoJSONReader(iter_chunks(path)):
+        properties = feature["properties"]
+        if columns is None:
+            columns = detect_columns(properties, fields)
+        yield map_fields(properties, fields, columns)
+
+
+# the newest vintage of each dataset, as a (name, endpoint, documentation) tuple to be collected
+def dataset_vintages(datasets):
+    return [dataset[3][-1] for dataset in datasets]
+
+
+def load_validators():
+    if not os.path.exists(validators_path):
+        return {}
+    with open(validators_path) as f:
+        return json.load(f)
+
+
+def save_validators(validators):
+    os.makedirs(os.path.dirname(validators_path), exist_ok=True)
+    with open(validators_path, "w") as f:
+        json.dump(validators, f, indent=2, sort_keys=True)
+
+
+# collect a vintage of a dataset unless it is unchanged since it was last collected,
+# reporting if it was fetched, not-modified or failed, with the bytes read and time taken
+def collect_dataset(vintage, validators):
+    (name, endpoint, doc_url) = vintage
+    filename = extract_name_from_document_url(doc_url)
+    start = time.perf_counter()
+    report = {"name": name, "status": "fetched", "bytes": 0, "seconds": 0.0}
+
+    tmp = geojson_path(filename + ".tmp")
+    headers = {}
+    if os.path.exists(geojson_path(filename)):
+        v = validators.get(endpoint, {})
+        if v.get("etag"):
+            headers["If-None-Match"] = v["etag"]
+        if v.get("last-modified"):
+            headers["If-Modified-Since"] = v["last-modified"]
+
+    try:
+        with session.get(endpoint, headers=headers, stream=True) as r:
+            if r.status_code == 304:
+                report["status"] = "not-modified"
+            else:
+                r.raise_for_status()
+
+                def chunks():
+                    for chunk in r.iter_content(chunk_size=1 << 16):
+                        report["bytes"] += len(chunk)
+                        yield chunk
+
+                # the document is scanned as it is written to a temporary file, without decoding
+                # the features, so a failure, or a document which is incomplete, leaves the last
+                # collection in place, a feature which doesn't decode being reported by the build
+                print(f"Collect: {name}\nfrom: {endpoint}")
+                reader = GeoJSONReader(tee_chunks(chunks(), tmp))
+                for feature in reader.raw_features():
+                    pass
+                os.replace(tmp, geojson_path(filename))
+
+                validators[endpoint] = {
+                    "etag": r.headers.get("ETag"),
+                    "last-modified": r.headers.get("Last-Modified"),
+                }
+    except Exception as e:
+        report["status"] = "failed"
+        report["error"] = str(e)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+
+# collect the newest vintage of each dataset concurrently:
+# the GeoJSON is streamed through a pool of connections on the session,
+# rather than being held in memory, using the validators
+# kept in a file of their own to make conditional requests
+def collect_datasets(datasets, max_workers=None):
+    vintages = dataset_vintages(datasets)
+    max_workers = max_workers or max(1, len(vintages))
+    mount_origins([vintage[1] for vintage in vintages], max_workers)
+
+    validators = load_validators()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        reports = list(executor.map(lambda v: collect_dataset(v, validators), vintages))
+    save_validators(validators)
+    return reports
+
+
+# build a dataset from the collected GeoJSON of its newest vintage,
+# leaving the last build in place if it hasn't been collected
+def build_dataset(dataset):
+    (name, fields, save_path, vintages) = dataset
+    (title, endpoint, doc_url) = vintages[-1]
+    report = {"name": name, "status": "built", "rows": 0}
+
+    path = geojson_path(extract_name_from_document_url(doc_url))
+    if not os.path.exists(path):
+        report["status"] = "failed"
+        report["error"] = f"{title} hasn't been collected"
+        return report
+
+    # the features are mapped and written one at a time, counting the rows as they pass
+    def rows():
+        for row in read_features(path, fields):
+            report["rows"] += 1
+            yield row
+
+    json_to_csv_file(save_path, rows())
+    return report
+
+
+def build_datasets(datasets, max_workers=None):
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, len(datasets))) as executor:
+        return list(executor.map(build_dataset, datasets))
+
+
+# the joins of a lookup of statistical geography codes to identifiers,
+# each mapping is a (statistical geography field, field, table) tuple,
+# where the field may be a (field, new name) tuple
+def statistical_geography_joins(mappings):
+    joins = []
+    for (statistical_geography_field, field, table) in mappings:
+        (column, name) = field if type(field) == tuple else (field, field)
+        joins.append(
+            (statistical_geography_field, table, "statistical-geography", column, name)
+        )
+    return joins
 
 
 def map_statistical_geography_lookup(
-    statistical_geography_lookup, mappings, keep=False
+    statistical_geography_lookup, mappings, keep=False, how="left"
 ):
-    mapped_dict = statistical_geography_lookup
-
-    for mapping in mappings:
-
-        # eg ('la-statistical-geography', 'organisation', las)
-        (statistical_geography_field, field, table) = mapping
+    # eg ('la-statistical-geography', 'organisation', las)
+    drop = [] if keep else [mapping[0] for mapping in mappings]
+    return join(
+        statistical_geography_lookup,
+        statistical_geography_joins(mappings),
+        how,
+        drop,
+    )
 
-        for entry in mapped_dict:
-            entry["statistical-geography"] = entry[statistical_geography_field]
 
-        if type(field) == tuple:
-            # handle cases where we want to rename newly added field
-            mapped_dict = joiner(
-                mapped_dict, table, "statistical-geography", [field[0]]
-            )
-            rename_field(mapped_dict, field[0], field[1])
-        else:
-            mapped_dict = joiner(mapped_dict, table, "statistical-geography", [field])
+def map_to_identifiers(lookup, mappings, output, exclude_incomplete=True, patch=None):
+    # load lookup data
+    lookup_data = get_csv_as_json(f"data/lookup/{lookup}.csv")
 
-        # remove temp field
-        mapped_dict = remove_field(mapped_dict, "statistical-geography")
-        if not keep:
-            # if not keeping also remove the original statistical geography field
-            mapped_dict = remove_field(mapped_dict, statistical_geography_field)
+    # only include lookup entry if all keys have a value
+    data = map_statistical_geography_lookup(
+        lookup_data, mappings, how="inner" if exclude_incomplete else "left"
+    )
 
-    return mapped_dict
+    # add patched entries missing from the lookup
+    if patch:
+        data = patcher(patch, data, "organisation")
 
+    # write to file
+    json_to_csv_file(f"data/lookup/{output}.csv", data)
 
-def map_to_identifiers(lookup, mappings, output, exclude_incomplete=True):
-    # load lookup data
-    lookup_data = get_csv_as_json(f"data/lookup/{lookup}.csv")
 
-    data = map_statistical_geography_lookup(lookup_data, mappings)
+# map the lookups concurrently, each table being indexed by statistical geography
+# once, before the lookups start, with the index shared by every lookup joining to it
+def map_lookups(lookups, tables, max_workers=None):
+    for table in tables.values():
+        index_table(table, "statistical-geography")
 
-    if exclude_incomplete:
-        # only include lookup entry if all keys have a value
-        successfully_mapped = []
-        for r in data:
-            if None not in r.values():
-                successfully_mapped.append(r)
-    else:
-        successfully_mapped = data
+    def map_lookup(lookup):
+        (name, mappings, output, patch) = lookup
+        mappings = [(field, column, tables[table]) for (field, column, table) in mappings]
+        map_to_identifiers(name, mappings, output, patch=patch)
 
-    # write to file
-    json_to_csv_file(f"data/lookup/{output}.csv", successfully_mapped)
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, len(lookups))) as executor:
+        list(executor.map(map_lookup, lookups))
 
 
 def patcher(patch, data, idx):
     exists = [x[idx] for x in data]
     # load patched names
-    for row in csv.DictReader(open(f"patch/{patch}.csv")):
+    for row in read_records(f"patch/{patch}.csv"):
         if row[idx] not in exists:
             patch_entry = {}
             for k in row.keys():
@@ -258,56 +734,46 @@ def patcher(patch, data, idx):
 
 if __name__ == "__main__":
 
-    # collect LRF and Region data
-    for dataset in datasets:
-        (name, endpoint, doc_url, fields, save_path) = dataset
-        filename = extract_name_from_document_url(doc_url)
-        entries = collect_geojson(name, endpoint, filename, fields)
-        json_to_csv_file(save_path, entries)
-
-    # load remote data
-    organisations = get_csv_as_json(organisation_csv, cache=True)
-    regions = get_csv_as_json(region_csv, cache=True)
-
-    # map statistical geography lookups to identifier lookups
-    map_to_identifiers(
-        "statistical-geography-la-to-lrf-lookup",
-        [
-            ("la-statistical-geography", "organisation", organisations),
-            (
-                "lrf-statistical-geography",
-                "local-resilience-forum",
-                get_csv_as_json("data/local-resilience-forum.csv"),
-            ),
-        ],
-        "local-resilience-forum-to-local-authority",
+    parser = argparse.ArgumentParser(description="map ONS lookups to organisations")
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="use the datasets already collected, and the cache in %s, without touching the network"
+        % (remote_cache_dir),
     )
-
-    map_to_identifiers(
-        "statistical-geography-la-to-comb-lookup",
-        [
-            (
-                "comb-statistical-geography",
-                ("organisation", "combined-authority"),
-                organisations,
-            ),
-            ("la-statistical-geography", "organisation", organisations),
-        ],
-        "local-authority-to-combined-authority",
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        default=24,
+        help="hours before a cached remote file is checked for changes",
     )
+    args = parser.parse_args()
+
+    # collect the ONS datasets, then build them from the newest vintage of each
+    reports = [] if args.offline else collect_datasets(ons_datasets)
+    for report in reports:
+        print(
+            "%(status)s %(bytes)d bytes in %(seconds).3fs: %(name)s" % report
+            + (" (%s)" % report["error"] if "error" in report else "")
+        )
+
+    builds = build_datasets(ons_datasets)
+    for report in builds:
+        print(
+            "%(status)s %(rows)d rows: %(name)s" % report
+            + (" (%s)" % report["error"] if "error" in report else "")
+        )
+
+    # load remote data, from local copies where we have them
+    max_age = args.max_age * 60 * 60
+    tables = {
+        "organisation": get_csv_as_json(organisation_csv, True, args.offline, max_age),
+        "region": get_csv_as_json(region_csv, True, args.offline, max_age),
+        "local-resilience-forum": get_csv_as_json("data/local-resilience-forum.csv"),
+    }
 
-    map_to_identifiers(
-        "statistical-geography-la-to-region-lookup",
-        [
-            ("la-statistical-geography", "organisation", organisations),
-            ("region-statistical-geography", "region", regions),
-        ],
-        "local-authority-to-region",
-    )
+    # map statistical geography lookups to identifier lookups
+    map_lookups(identifier_lookups, tables)
 
-    # load patched missing regions
-    file_to_patch = "data/lookup/local-authority-to-region.csv"
-    patched_region_lookup = patcher(
-        "region", get_csv_as_json(file_to_patch), "organisation"
-    )
-    json_to_csv_file(file_to_patch, patched_region_lookup)
+    if any(report["status"] == "failed" for report in reports + builds):
+        sys.exit(2)
@@ -0,0 +1,86 @@
+# load CSV files as records, or columns, of strings,
+# without importing pandas or guessing at types:
+# codes such as "E06000001" or "0123" are kept as they are,
+# and an empty cell is "", or whatever value is given for empty
+
+import io
+import csv
+import mmap
+import tempfile
+from operator import itemgetter
+
+
+# the text of a file, decoded straight from a memory map of it
+def read_text(path, encoding="utf-8"):
+    with open(path, "rb") as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                text = str(m, encoding)
+        except ValueError:
+            # an empty file can't be mapped
+            return ""
+
+    # universal newlines, as reading the file in text mode would
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+# the header and rows, each at least the length of the header, skipping blank lines:
+# as with csv.DictReader, a short row is padded with None,
+# and a long row keeps the values beyond the header
+def parse_rows(text, empty=""):
+    reader = csv.reader(io.StringIO(text))
+    header = next(reader, None)
+    if header is None:
+        return [], []
+
+    width = len(header)
+    rows = [row for row in reader if row]
+    if any(len(row) < width for row in rows):
+        rows = [row if len(row) >= width else row + [None] * (width - len(row)) for row in rows]
+    if empty != "":
+        rows = [[value if value != "" else empty for value in row] for row in rows]
+    return header, rows
+
+
+# a list of dictionaries, one for each row, from a string or the body of a response:
+# as with csv.DictReader, values beyond the header are a list under the key None
+def parse_records(text, empty=""):
+    header, rows = parse_rows(text, empty)
+    width = len(header)
+    records = [dict(zip(header, row)) for row in rows]
+    for record, row in zip(records, rows):
+        if len(row) > width:
+            record[None] = row[width:]
+    return records
+
+
+# a dictionary of lists, one for each column of the header
+def parse_columns(text, empty=""):
+    header, rows = parse_rows(text, empty)
+    columns = zip(*rows) if rows else [()] * len(header)
+    return {field: list(values) for field, values in zip(header, columns)}
+
+
+def read_records(path, empty=""):
+    return parse_records(read_text(path), empty)
+
+
+def read_columns(path, empty=""):
+    return parse_columns(read_text(path), empty)
+
+
+# spill a sorted run of (key, row) pairs to a temporary file, for merging with others
+def save_run(run):
+    f = tempfile.TemporaryFile("w+", newline="")
+    w = csv.writer(f)
+    for (key, row) in sorted(run, key=itemgetter(0)):
+        w.writerow([key] + row)
+    f.seek(0)
+    return f
+
+
+def read_run(f):
+    for row in csv.reader(f):
+        yield row[0], row[1:]
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+# read the rows of the tables in a Word document as they are parsed,
+# streaming word/document.xml from the DOCX without building a tree of the whole document
+
+import sys
+import csv
+import argparse
+from zipfile import ZipFile
+from xml.etree.ElementTree import iterparse
+
+w = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+# text of the elements within a run, as python-docx gives it
+run_text = {
+    w + "tab": "\t",
+    w + "ptab": "\t",
+    w + "cr": "\n",
+    w + "noBreakHyphen": "-",
+}
+
+
+def paragraph_text(p):
+    text = []
+    for e in p.iter():
+        if e.tag == w + "t":
+            text.append(e.text or "")
+        elif e.tag == w + "br":
+            if e.get(w + "type", "textWrapping") == "textWrapping":
+                text.append("\n")
+        elif e.tag in run_text:
+            text.append(run_text[e.tag])
+    return "".join(text)
+
+
+# the text of a cell is its paragraphs, one to a line
+def cell_text(tc):
+    return "\n".join(paragraph_text(p) for p in tc.findall(w + "p"))
+
+
+# the text of each cell in a row, a cell spanning columns repeated for each column,
+# and a cell continuing a vertical merge given the text of the cell above
+def row_cells(tr, above):
+    cells = []
+    for tc in tr.findall(w + "tc"):
+        properties = tc.find(w + "tcPr")
+        span = 1
+        merge = None
+        if properties is not None:
+            grid_span = properties.find(w + "gridSpan")
+            if grid_span is not None:
+                span = int(grid_span.get(w + "val", "1"))
+            v_merge = properties.find(w + "vMerge")
+            if v_merge is not None:
+                merge = v_merge.get(w + "val", "continue")
+
+        if merge == "continue" and len(cells) < len(above):
+            text = above[len(cells)]
+        else:
+            text = cell_text(tc)
+        cells.extend([text] * span)
+    return cells
+
+
+# (table, cells) for each row of each table in the body of a DOCX file or file object,
+# where table counts the tables from 0, rows of tables nested in a cell aren't included
+def table_rows(docx):
+    with ZipFile(docx) as z, z.open("word/document.xml") as xml:
+        body = None
+        depth = 0
+        table = -1
+        above = []
+        for (event, e) in iterparse(xml, events=("start", "end")):
+            if event == "start":
+                if e.tag == w + "body":
+                    body = e
+                elif e.tag == w + "tbl":
+                    depth += 1
+                    if depth == 1:
+                        table += 1
+                        above = []
+                continue
+
+            if e.tag == w + "tbl":
+                depth -= 1
+            elif e.tag == w + "tr" and depth == 1:
+                above = row_cells(e, above)
+                yield (table, above)
+                e.clear()
+
+            # let go of each part of the body once it has been read
+            if depth == 0 and body is not None and e is not body and e in body:
+                body.remove(e)
+
+
+# the rows of a table as dictionaries, keyed by the text in its first row
+def table_records(docx, number=0):
+    keys = None
+    for (table, cells) in table_rows(docx):
+        if table < number:
+            continue
+        if table > number:
+            break
+        if keys is None:
+            keys = tuple(cells)
+            continue
+        yield dict(zip(keys, cells))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="tables in a Word document as CSV")
+    parser.add_argument("docx", help="DOCX file")
+    parser.add_argument("--table", type=int, default=0, help="number of the table, from 0")
+    args = parser.parse_args()
+
+    writer = csv.writer(sys.stdout)
+    for (table, cells) in table_rows(args.docx):
+        if table == args.table:
+            writer.writerow(cells)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# resolve URLs and host names to the organisation which owns them, by the longest
+# suffix of their host in a trie of domains, with the labels of each domain reversed,
+# built from the government-domain register and the websites of the organisations
+
+import re
+import sys
+import csv
+import argparse
+
+from csvload import read_records
+from identifiers import host
+
+register_csv = "collection/register/government-domain.csv"
+organisation_csv = "collection/organisation.csv"
+
+# the register holds the label of each domain under gov.uk
+register_suffix = ".gov.uk"
+
+
+class DomainTrie:
+    def __init__(self):
+        self.root = {}
+
+    # the organisation owning a domain, and every host within it
+    def add(self, hostname, organisation, replace=True):
+        node = self.root
+        for label in reversed(hostname.split(".")):
+            node = node.setdefault(label, {})
+        if replace or None not in node:
+            node[None] = organisation
+
+    # the organisation owning the longest suffix of the host, or None
+    def lookup(self, hostname):
+        node = self.root
+        found = None
+        for label in reversed(hostname.split(".")):
+            node = node.get(label, None)
+            if node is None:
+                break
+            found = node.get(None, found)
+        return found
+
+    def __contains__(self, hostname):
+        node = self.root
+        for label in reversed(hostname.split(".")):
+            node = node.get(label, None)
+            if node is None:
+                return False
+        return None in node
+
+
+# domains in the register, those still in use taking precedence over those which have ended
+def load_register(trie, path=register_csv):
+    rows = [row for row in read_records(path) if row["hostname"] and row["organisation"]]
+    rows.sort(key=lambda row: (not row["end-date"], row["start-date"]))
+    for row in rows:
+        trie.add(row["hostname"].lower() + register_suffix, row["organisation"])
+    return trie
+
+
+# hosts of the websites of organisations, where a host isn't shared with another organisation
+# and isn't already in the register
+def load_websites(trie, path=organisation_csv):
+    owners = {}
+    for row in read_records(path):
+        hostname = host(row.get("website", "") or "")
+        if hostname:
+            owners.setdefault(hostname, set()).add(row["organisation"])
+
+    for hostname, organisations in owners.items():
+        if len(organisations) == 1:
+            trie.add(hostname, organisations.pop(), replace=False)
+    return trie
+
+
+def build(register=register_csv, organisations=organisation_csv):
+    trie = load_register(DomainTrie(), register)
+    if organisations:
+        load_websites(trie, organisations)
+    return trie
+
+
+# the part of a URL, or host name, which has the host in it
+netloc_pattern = re.compile(r"\s*(?:[A-Za-z][A-Za-z0-9+.-]*:)?//([^/?#]*)|\s*([^/?#]*)")
+
+
+# (url, organisation) for each of any number of URLs or host names,
+# parsing and looking up each distinct host once
+def resolve_many(trie, urls):
+    resolved = {}
+    for url in urls:
+        match = netloc_pattern.match(url)
+        netloc = match.group(1) if match.group(1) is not None else match.group(2)
+        organisation = resolved.get(netloc, "")
+        if organisation == "":
+            hostname = host(netloc) if netloc else ""
+            organisation = resolved[netloc] = trie.lookup(hostname) if hostname else None
+        yield (url, organisation)
+
+
+# organisations whose website is on a host which isn't in the register,
+# or which the register gives to another organisation, as (organisation, website, issue) tuples
+def unregistered(register=register_csv, organisations=organisation_csv):
+    trie = load_register(DomainTrie(), register)
+    for row in read_records(organisations):
+        if not row.get("website") or row.get("end-date"):
+            continue
+        owner = trie.lookup(host(row["website"]))
+        if owner is None:
+            yield (row["organisation"], row["website"], "not in the register")
+        elif owner != row["organisation"]:
+            yield (row["organisation"], row["website"], "registered to %s" % (owner))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="resolve URLs or host names, read from stdin, to organisations")
+    parser.add_argument("--register", default=register_csv, help="government domain register")
+    parser.add_argument("--organisations", default=organisation_csv, help="organisations with websites")
+    parser.add_argument(
+        "--unregistered",
+        action="store_true",
+        help="list current organisations whose website isn't theirs in the register",
+    )
+    args = parser.parse_args()
+
+    w = csv.writer(sys.stdout)
+    if args.unregistered:
+        w.writerow(["organisation", "website", "issue"])
+        w.writerows(unregistered(args.register, args.organisations))
+    else:
+        trie = build(args.register, args.organisations)
+        w.writerow(["url", "organisation"])
+        urls = (line.rstrip("\n") for line in sys.stdin)
+        for (url, organisation) in resolve_many(trie, urls):
+            w.writerow([url, organisation or ""])
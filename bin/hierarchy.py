@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+# the areas each organisation is within, such as a region, combined authority,
+# local resilience forum or hub, closed transitively into a table of every
+# (organisation, area) pair, so the ancestors and descendants of an organisation or area
+# are found with a single lookup, and values for organisations can be rolled up
+# into every area at once
+
+import sys
+import csv
+import argparse
+import numpy as np
+
+from csvload import read_records
+
+organisation_csv = "collection/organisation.csv"
+
+# files relating organisations to areas, with the column of the organisation,
+# and a column for each kind of area
+relationships = [
+    ("data/lookup/local-authority-to-region.csv", ["region"]),
+    ("data/lookup/local-resilience-forum-to-local-authority.csv", ["local-resilience-forum"]),
+    ("data/lookup/local-authority-to-combined-authority.csv", ["combined-authority"]),
+    ("data/local-authority-to-hub.csv", ["hub"]),
+    (organisation_csv, ["combined-authority", "local-resilience-forum", "region"]),
+]
+
+
+# the node for an area, a combined authority being an organisation in its own right
+def area(kind, value):
+    if kind == "combined-authority":
+        return value if ":" in value else "local-authority-eng:" + value
+    return kind + ":" + value
+
+
+# the parents of each node, and the kind of each area, from the relationships
+def load_relationships(sources=relationships):
+    parents = {}
+    kinds = {}
+    for (path, columns) in sources:
+        for row in read_records(path):
+            organisation = row["organisation"]
+            for kind in columns:
+                if row.get(kind):
+                    parent = area(kind, row[kind])
+                    kinds[parent] = kind
+                    parents.setdefault(organisation, set()).add(parent)
+
+    # a combined authority is within a region where all of its members are
+    members = {}
+    for (organisation, areas) in parents.items():
+        for parent in areas:
+            if kinds[parent] == "combined-authority":
+                members.setdefault(parent, []).append(organisation)
+    for (authority, organisations) in members.items():
+        regions = set(
+            parent
+            for organisation in organisations
+            for parent in parents[organisation]
+            if kinds[parent] == "region"
+        )
+        if len(regions) == 1:
+            parents.setdefault(authority, set()).update(regions)
+
+    return parents, kinds
+
+
+class Hierarchy:
+    def __init__(self, parents, kinds):
+        self.kinds = kinds
+
+        # the depth of each ancestor of each node
+        self.closure = {}
+        for node in list(parents):
+            self.close(node, parents, ())
+
+        self.nodes = sorted(set(self.closure) | set(kinds))
+        self.position = {node: i for i, node in enumerate(self.nodes)}
+
+        self._ancestors = {}
+        self._descendants = {}
+        for (node, ancestors) in self.closure.items():
+            for ancestor in ancestors:
+                for key in [None, kinds[ancestor]]:
+                    self._ancestors.setdefault((node, key), set()).add(ancestor)
+                for key in [None, self.kind(node)]:
+                    self._descendants.setdefault((ancestor, key), set()).add(node)
+        self._ancestors = {key: frozenset(nodes) for (key, nodes) in self._ancestors.items()}
+        self._descendants = {key: frozenset(nodes) for (key, nodes) in self._descendants.items()}
+
+        # the ancestors of each node as slices of one array, for roll-ups
+        ancestors = [
+            sorted(self.position[ancestor] for ancestor in self.closure.get(node, ()))
+            for node in self.nodes
+        ]
+        self.counts = np.array([len(a) for a in ancestors], dtype=np.int64)
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]]).astype(np.int64)
+        self.flat = np.array([i for a in ancestors for i in a], dtype=np.int64)
+
+    @classmethod
+    def load(cls, sources=relationships):
+        return cls(*load_relationships(sources))
+
+    def close(self, node, parents, path):
+        if node in self.closure:
+            return self.closure[node]
+        if node in path:
+            raise ValueError("%s is within itself" % (node))
+
+        depths = {}
+        for parent in parents.get(node, ()):
+            candidates = [(parent, 1)] + [
+                (ancestor, depth + 1)
+                for (ancestor, depth) in self.close(parent, parents, path + (node,)).items()
+            ]
+            for (ancestor, depth) in candidates:
+                if depth < depths.get(ancestor, depth + 1):
+                    depths[ancestor] = depth
+        self.closure[node] = depths
+        return depths
+
+    # the kind of an area, or "organisation"
+    def kind(self, node):
+        return self.kinds.get(node, "organisation")
+
+    # the areas a node is within, optionally of one kind
+    def ancestors(self, node, kind=None):
+        return self._ancestors.get((node, kind), frozenset())
+
+    # the organisations and areas within an area, optionally of one kind
+    def descendants(self, node, kind=None):
+        return self._descendants.get((node, kind), frozenset())
+
+    def within(self, node, ancestor):
+        return ancestor in self.ancestors(node)
+
+    # (descendant, ancestor, kind of ancestor, depth) for every pair in the closure
+    def rows(self):
+        for node in sorted(self.closure):
+            for (ancestor, depth) in sorted(self.closure[node].items()):
+                yield (node, ancestor, self.kinds[ancestor], depth)
+
+    # the totals of values for nodes in each area they are within, optionally of the given kinds,
+    # values may be a column, or an array with a row for each node,
+    # nodes which aren't within an area are left out
+    def rollup(self, nodes, values, kinds=None):
+        values = np.asarray(values)
+        known = [i for i, node in enumerate(nodes) if node in self.position]
+        positions = np.array([self.position[nodes[i]] for i in known], dtype=np.int64)
+        values = values[np.array(known, dtype=np.int64)]
+
+        counts = self.counts[positions]
+        total = int(counts.sum())
+        offsets = np.arange(total, dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+        ancestors = self.flat[np.repeat(self.starts[positions], counts) + offsets]
+
+        totals = np.zeros((len(self.nodes),) + values.shape[1:], dtype=np.result_type(values, np.int64))
+        np.add.at(totals, ancestors, np.repeat(values, counts, axis=0))
+
+        result = {}
+        for i in np.unique(ancestors).tolist():
+            node = self.nodes[i]
+            if kinds is None or self.kinds[node] in kinds:
+                result[node] = totals[i].tolist()
+        return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="areas organisations are within")
+    parser.add_argument(
+        "command",
+        choices=["closure", "ancestors", "descendants", "rollup"],
+        help="closure: the table of every (organisation, area) pair, "
+        "rollup: totals of organisation,value rows read from stdin for each area",
+    )
+    parser.add_argument("nodes", nargs="*", help="organisations or areas, such as region:london")
+    parser.add_argument("--kind", action="append", help="kind of area, may be repeated")
+    args = parser.parse_args()
+
+    hierarchy = Hierarchy.load()
+    w = csv.writer(sys.stdout)
+
+    if args.command == "closure":
+        w.writerow(["organisation", "area", "kind", "depth"])
+        w.writerows(hierarchy.rows())
+    elif args.command == "rollup":
+        rows = list(csv.reader(sys.stdin))[1:]
+        nodes = [row[0] for row in rows]
+        values = [float(row[1]) if "." in row[1] else int(row[1]) for row in rows]
+        w.writerow(["area", "kind", "value"])
+        for (node, value) in sorted(hierarchy.rollup(nodes, values, args.kind).items()):
+            w.writerow([node, hierarchy.kind(node), value])
+    else:
+        find = hierarchy.ancestors if args.command == "ancestors" else hierarchy.descendants
+        w.writerow(["node", args.command[:-1], "kind"])
+        for node in args.nodes:
+            for kind in args.kind or [None]:
+                for other in sorted(find(node, kind)):
+                    w.writerow([node, other, hierarchy.kind(other)])
@@ -0,0 +1,26 @@
+# columns which identify an organisation, and how their values are normalised,
+# shared by the build, which indexes them, and the lookups which resolve them
+
+from urllib.parse import urlsplit
+
+
+# the host of a website, which may be given as a URL or bare host name
+def host(value):
+    if "://" not in value:
+        value = "//" + value
+    try:
+        hostname = urlsplit(value.strip()).hostname or ""
+    except ValueError:
+        return ""
+    return hostname[4:] if hostname.startswith("www.") else hostname
+
+
+identifiers = {
+    "entity": None,
+    "wikidata": None,
+    "statistical-geography": None,
+    "billing-authority": None,
+    "addressbase-custodian": None,
+    "opendatacommunities": None,
+    "website": host,
+}
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+# resolve organisations from their identifiers, using indexes of the built dataset:
+# dictionaries for a dataset loaded from CSV, or sorted arrays which can be saved
+# and memory-mapped, so processes share one copy of the indexes without parsing the CSV
+
+import os
+import sys
+import argparse
+import numpy as np
+
+from csvload import read_columns
+from identifiers import identifiers
+
+organisation_csv = "collection/organisation.csv"
+
+
+class OrganisationLookup:
+    # organisations is an array of curies, and each index a pair of arrays:
+    # the values of the column sorted, and the position of the organisation with each value,
+    # those without an end-date before those with one, so the first found is the one to use
+    def __init__(self, organisations, indexes, tables=None):
+        self.organisations = organisations
+        self.indexes = indexes
+        self.tables = tables
+
+    @classmethod
+    def from_csv(cls, path=organisation_csv):
+        columns = read_columns(path)
+        organisations = np.array(columns["organisation"], dtype=str)
+        order = np.argsort(
+            np.array([bool(date) for date in columns["end-date"]]), kind="stable"
+        )
+
+        indexes = {}
+        tables = {}
+        for column, normalise in identifiers.items():
+            values = columns.get(column, [""] * len(organisations))
+            if normalise:
+                values = [normalise(value) if value else "" for value in values]
+            values = np.array(values, dtype=str)[order]
+            rows = order[values != ""]
+            values = values[values != ""]
+
+            ranked = np.argsort(values, kind="stable")
+            keys = values[ranked]
+            indexes[column] = (keys, rows[ranked])
+
+            # the first position of each value, for lookups in constant time
+            table = tables[column] = {}
+            for position, key in enumerate(keys.tolist()):
+                table.setdefault(key, position)
+
+        return cls(organisations, indexes, tables)
+
+    # arrays saved as .npy files in a directory, to be loaded with load
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "organisation.npy"), self.organisations)
+        for column, (keys, rows) in self.indexes.items():
+            np.save(os.path.join(directory, column + "-keys.npy"), keys)
+            np.save(os.path.join(directory, column + "-rows.npy"), rows)
+
+    # memory-map saved indexes, values are found by binary search
+    @classmethod
+    def load(cls, directory):
+        def array(name):
+            return np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")
+
+        indexes = {
+            column: (array(column + "-keys"), array(column + "-rows"))
+            for column in identifiers
+        }
+        return cls(array("organisation"), indexes)
+
+    def normalise(self, column, value):
+        if column not in self.indexes:
+            raise KeyError("unknown identifier '%s'" % (column))
+        normalise = identifiers.get(column)
+        return normalise(value) if (normalise and value) else (value or "")
+
+    # the range of positions in the index with the value
+    def span(self, column, value):
+        keys = self.indexes[column][0]
+        if self.tables is not None:
+            start = self.tables[column].get(value)
+            if start is None:
+                return (0, 0)
+        else:
+            start = int(np.searchsorted(keys, value, side="left"))
+        end = start
+        while end < len(keys) and keys[end] == value:
+            end += 1
+        return (start, end)
+
+    # the curie of the organisation with the identifier, or None
+    def resolve(self, column, value):
+        (start, end) = self.span(column, self.normalise(column, value))
+        if start == end:
+            return None
+        return str(self.organisations[self.indexes[column][1][start]])
+
+    # the curies of every organisation with the identifier
+    def resolve_all(self, column, value):
+        (start, end) = self.span(column, self.normalise(column, value))
+        rows = self.indexes[column][1][start:end]
+        return [str(self.organisations[row]) for row in rows]
+
+    # the curies of the organisations for a column of identifiers, with None where there is no match
+    def resolve_many(self, column, values):
+        values = [self.normalise(column, value) for value in values]
+        if self.tables is not None:
+            table = self.tables[column]
+            positions = [table.get(value, -1) for value in values]
+            rows = self.indexes[column][1]
+            return [
+                str(self.organisations[rows[position]]) if position >= 0 else None
+                for position in positions
+            ]
+
+        (keys, rows) = self.indexes[column]
+        if not len(keys) or not values:
+            return [None] * len(values)
+        values = np.array(values, dtype=str)
+        positions = np.searchsorted(keys, values, side="left")
+        positions[positions == len(keys)] = 0
+        found = keys[positions] == values
+        curies = self.organisations[rows[positions]]
+        return [str(curie) if ok else None for curie, ok in zip(curies, found)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="resolve organisations from their identifiers")
+    parser.add_argument("column", nargs="?", choices=list(identifiers), help="identifier to resolve")
+    parser.add_argument("values", nargs="*", help="values to resolve, read from stdin if there are none")
+    parser.add_argument("--csv", default=organisation_csv, help="organisations to index")
+    parser.add_argument("--index", help="directory of indexes saved with --save, memory-mapped")
+    parser.add_argument("--save", help="save indexes of the organisations to a directory")
+    args = parser.parse_args()
+
+    if args.index:
+        lookup = OrganisationLookup.load(args.index)
+    else:
+        lookup = OrganisationLookup.from_csv(args.csv)
+
+    if args.save:
+        lookup.save(args.save)
+
+    if args.column:
+        values = args.values or [line.rstrip("\n") for line in sys.stdin]
+        for value, curie in zip(values, lookup.resolve_many(args.column, values)):
+            print("%s,%s" % (value, curie or ""))
+    elif not args.save:
+        parser.error("an identifier to resolve, or --save, is needed")
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+# match organisation names as they are written by others against the names we know,
+# by normalising away the words which vary, such as "Council" or "City of",
+# then ranking candidates by the trigrams they share
+
+import re
+import sys
+import csv
+import heapq
+import argparse
+from collections import Counter
+
+# phrases and words which are left out when comparing names
+phrases = [
+    ("&", " and "),
+    ("london borough of ", " "),
+    ("royal borough of ", " "),
+    ("metropolitan borough of ", " "),
+    ("county borough of ", " "),
+    ("borough of ", " "),
+    ("city and county of ", " "),
+    ("city of ", " "),
+    ("county of ", " "),
+]
+stop_words = set(
+    [
+        "the",
+        "council",
+        "borough",
+        "city",
+        "county",
+        "district",
+        "metropolitan",
+        "mdc",
+        "ua",
+    ]
+)
+
+
+def normalise(name):
+    name = " " + name.lower().replace("'", "").replace("’", "") + " "
+    for (phrase, replacement) in phrases:
+        name = name.replace(" " + phrase, replacement)
+    words = re.sub(r"[^a-z0-9]+", " ", name).split()
+    kept = [word for word in words if word not in stop_words]
+    return " ".join(kept or words)
+
+
+def trigrams(name):
+    padded = "  " + name + " "
+    return set(padded[i : i + 3] for i in range(len(padded) - 2))
+
+
+class NameMatcher:
+    def __init__(self):
+        self.names = []
+        self.grams = []
+        self.organisations = []
+        self.exact = {}
+        self.postings = {}
+
+    # a name, or official-name, of an organisation, the first added is preferred
+    def add(self, name, organisation):
+        if not name:
+            return
+        key = normalise(name)
+        self.exact.setdefault(key, organisation)
+
+        n = len(self.names)
+        grams = trigrams(key)
+        self.names.append(name)
+        self.grams.append(len(grams))
+        self.organisations.append(organisation)
+        for gram in grams:
+            self.postings.setdefault(gram, []).append(n)
+
+    # the organisation with a name which is the same once normalised, or None
+    def lookup(self, name):
+        return self.exact.get(normalise(name))
+
+    # candidates as (organisation, name, score) tuples, best first,
+    # scored by the Dice coefficient of their trigrams, 1.0 for names which normalise the same
+    def match(self, name, limit=5):
+        key = normalise(name)
+        grams = trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+
+        best = {}
+        for (n, count) in shared.items():
+            organisation = self.organisations[n]
+            score = 2.0 * count / (len(grams) + self.grams[n])
+            if score > best.get(organisation, (None, 0.0))[1]:
+                best[organisation] = (self.names[n], score)
+
+        exact = self.exact.get(key)
+        if exact:
+            best[exact] = (best.get(exact, (name,))[0], 1.0)
+
+        candidates = heapq.nsmallest(
+            limit, best.items(), key=lambda item: (-item[1][1], item[1][0])
+        )
+        return [(organisation, n, round(score, 3)) for (organisation, (n, score)) in candidates]
+
+    def match_many(self, names, limit=5):
+        return [self.match(name, limit) for name in names]
+
+    # the best candidate, if it scores at least threshold and is clear of the next
+    def best(self, name, threshold=0.8, margin=0.1):
+        candidates = self.match(name, 2)
+        if not candidates or candidates[0][2] < threshold:
+            return None
+        if len(candidates) > 1 and candidates[0][2] - candidates[1][2] < margin:
+            return None
+        return candidates[0][0]
+
+
+# a matcher of the names and official names in registers
+def load_registers(registers, directory="collection/register/"):
+    matcher = NameMatcher()
+    for prefix in registers:
+        for row in csv.DictReader(open(directory + prefix + ".csv")):
+            organisation = prefix + ":" + row[prefix]
+            matcher.add(row.get("name", ""), organisation)
+            matcher.add(row.get("official-name", ""), organisation)
+    return matcher
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="rank organisations matching each name")
+    parser.add_argument("registers", nargs="+", help="registers of names to match against")
+    parser.add_argument("--limit", type=int, default=5, help="candidates for each name")
+    args = parser.parse_args()
+
+    matcher = load_registers(args.registers)
+    names = [line.strip() for line in sys.stdin if line.strip()]
+
+    w = csv.writer(sys.stdout)
+    w.writerow(["name", "organisation", "candidate", "score"])
+    for name, candidates in zip(names, matcher.match_many(names, args.limit)):
+        for (organisation, candidate, score) in candidates:
+            w.writerow([name, organisation, candidate, score])
@@ -3,16 +3,30 @@
 import os.path
 import sys
 import csv
+import argparse
+import hashlib
+import json
+import pickle
+import sqlite3
+import threading
+import time
 import logging
-import re
 import validators
+import pandas as pd
 from datetime import datetime
+from functools import lru_cache
+from bisect import bisect_right
+from collections.abc import MutableMapping
+from operator import itemgetter
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+from csvload import read_records
+from identifiers import identifiers
 
 register_dir = "collection/register/"
 data_dir = "data/"
 
-organisations = {}
-
 fields = [
     "organisation",
     "entity",
@@ -40,180 +54,477 @@ fields = [
     "end-date",
 ]
 
+field_position = {field: i for i, field in enumerate(fields)}
+
+# other fields kept from the sources, as they are used to build the output fields,
+# along with the keys used by each patch stage, see stage_fields
+extra_fields = frozenset(["official-name"])
+
+# fields with few distinct values, shared rather than copied for each organisation
+interned_fields = set(
+    [
+        "local-authority-type",
+        "region",
+        "combined-authority",
+        "local-resilience-forum",
+    ]
+)
+
+
+# an organisation, with the values of the output fields held in a list
+# in the order of the fields, and any other fields from the sources in a dict
+class Organisation(MutableMapping):
+    __slots__ = ("values", "extra")
+
+    def __init__(self, *args, **kwargs):
+        self.values = [None] * len(fields)
+        self.extra = None
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, field):
+        i = field_position.get(field, None)
+        value = self.values[i] if i is not None else (self.extra or {}).get(field, None)
+        if value is None:
+            raise KeyError(field)
+        return value
+
+    def get(self, field, default=None):
+        i = field_position.get(field, None)
+        value = self.values[i] if i is not None else (self.extra or {}).get(field, None)
+        return default if value is None else value
+
+    def __contains__(self, field):
+        return self.get(field, None) is not None
+
+    def __setitem__(self, field, value):
+        i = field_position.get(field, None)
+        if field in interned_fields:
+            value = sys.intern(value)
+        if i is not None:
+            self.values[i] = value
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[sys.intern(field) if isinstance(field, str) else field] = value
+
+    def __delitem__(self, field):
+        i = field_position.get(field, None)
+        if i is not None and self.values[i] is not None:
+            self.values[i] = None
+        elif self.extra and field in self.extra:
+            del self.extra[field]
+        else:
+            raise KeyError(field)
+
+    def __iter__(self):
+        for field, value in zip(fields, self.values):
+            if value is not None:
+                yield field
+        if self.extra:
+            yield from list(self.extra)
+
+    def __len__(self):
+        return len(self.values) - self.values.count(None) + len(self.extra or {})
+
+    def __eq__(self, other):
+        if isinstance(other, Organisation):
+            return self.values == other.values and (self.extra or {}) == (other.extra or {})
+        return dict(self) == other
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    # the values of the output fields
+    def project(self):
+        return ["" if value is None else value for value in self.values]
+
+
+def project(o):
+    if isinstance(o, Organisation):
+        return o.project()
+    return [o.get(field, "") for field in fields]
+
+
+# organisations, or (curie, organisation) pairs, sorted by curie
+def sorted_organisations(organisations):
+    items = organisations.items() if isinstance(organisations, dict) else organisations
+    return sorted(items, key=itemgetter(0))
+
+
+def save(organisations, f=None):
+    w = csv.writer(f or sys.stdout)
+    w.writerow(fields)
+    for curie, o in sorted_organisations(organisations):
+        w.writerow(project(o))
+
+
+# columns stored in the SQLite export as numbers, dates, and references to a table of their values
+integer_fields = set(["entity"])
+sqlite_date_fields = set(["start-date", "end-date"])
+dictionary_fields = ["local-authority-type", "region", "combined-authority", "local-resilience-forum"]
+
+
+def sqlite_value(field, value):
+    if not value:
+        return None
+    if field in integer_fields and value.isdigit():
+        return int(value)
+    return value
+
+
+# save the organisations as an SQLite database, with columns typed, low cardinality
+# columns stored as references to a table of their values, and the identifiers indexed,
+# along with an organisation_view giving the values as they are in the CSV
+def save_sqlite(organisations, path):
+    def column(field):
+        if field in dictionary_fields:
+            return '"%s" INTEGER REFERENCES "%s"(id)' % (field, field)
+        if field in integer_fields:
+            return '"%s" INTEGER' % (field)
+        if field in sqlite_date_fields:
+            return '"%s" DATE' % (field)
+        if field == "organisation":
+            return '"organisation" TEXT PRIMARY KEY'
+        return '"%s" TEXT' % (field)
+
+    def view_column(field):
+        if field in dictionary_fields:
+            return '"%s".value AS "%s"' % (field, field)
+        return 'o."%s"' % (field)
+
+    tmp = path + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+    db = sqlite3.connect(tmp)
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    for field in dictionary_fields:
+        db.execute('CREATE TABLE "%s" (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)' % (field))
+    db.execute(
+        "CREATE TABLE organisation (%s) WITHOUT ROWID"
+        % (", ".join(column(field) for field in fields))
+    )
 
-def save(organisations):
-    w = csv.DictWriter(sys.stdout, fields, extrasaction="ignore")
-    w.writeheader()
-    for organisation in sorted(organisations):
-        w.writerow(organisations[organisation])
-
+    dictionaries = {field: {} for field in dictionary_fields}
+
+    def encode(field, value):
+        if not value:
+            return None
+        values = dictionaries[field]
+        if value not in values:
+            values[value] = len(values) + 1
+        return values[value]
+
+    positions = [(position, field) for position, field in enumerate(fields)]
+    rows = (
+        [
+            encode(field, values[position]) if field in dictionaries else sqlite_value(field, values[position])
+            for position, field in positions
+        ]
+        for values in (project(o) for curie, o in sorted_organisations(organisations))
+    )
+    db.executemany(
+        "INSERT INTO organisation VALUES (%s)" % (", ".join(["?"] * len(fields))),
+        rows,
+    )
+    for field, values in dictionaries.items():
+        db.executemany(
+            'INSERT INTO "%s" (value, id) VALUES (?, ?)' % (field), values.items()
+        )
+
+    for field in list(identifiers) + dictionary_fields:
+        db.execute('CREATE INDEX "organisation-%s" ON organisation ("%s")' % (field, field))
+
+    db.execute(
+        "CREATE VIEW organisation_view AS SELECT %s FROM organisation o %s ORDER BY o.organisation"
+        % (
+            ", ".join(view_column(field) for field in fields),
+            " ".join(
+                'LEFT JOIN "%s" ON "%s".id = o."%s"' % (field, field, field)
+                for field in dictionary_fields
+            ),
+        )
+    )
+    db.commit()
+    db.close()
+    os.replace(tmp, path)
+
+
+# save the organisations to a file for each curie prefix, written concurrently
+def save_shards(organisations, directory, max_workers=None):
+    shards = {}
+    for curie, o in organisations.items():
+        shards.setdefault(curie.split(":")[0], []).append((curie, o))
+
+    def save_shard(prefix):
+        with open(csv_path(directory, prefix), "w", newline="") as f:
+            save(shards[prefix], f)
+
+    os.makedirs(directory, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(save_shard, shards))
+
+
+# statistical-geography code patterns, by prefix and local-authority-type
+statistical_geography_patterns = {
+    "local-authority-eng:UA": r"^E06000\d\d\d",
+    "local-authority-eng:NMD": r"^E07000\d\d\d",
+    "local-authority-eng:MD": r"^E08000\d\d\d",
+    "local-authority-eng:LBO": r"^E09000\d\d\d",
+    "local-authority-eng:CC": r"^E09000\d\d\d",
+    "local-authority-eng:CTY": r"^E10000\d\d\d",
+    "local-authority-eng:SRA": r"^E12000\d\d\d",
+    "local-authority-eng:COMB": r"^E47000\d\d\d",
+    "national-park-authority:": r"^E260000\d\d",
+    "development-corporation:": r"^E510000\d\d",
+}
+
+url_fields = ["opendatacommunities", "opendatacommunities-area", "website"]
+date_fields = ["start-date", "end-date"]
+
+# fields every organisation must have, and every active organisation
+mandatory_fields = ["entity", "name", "wikidata"]
+active_mandatory_fields = ["website"]
+
+local_prefixes = ["local-authority-eng", "national-park-authority", "development-corporation"]
+local_fields = ["statistical-geography", "opendatacommunities", "opendatacommunities-area"]
+
+# rules for active organisations, the first matching rule applies:
+# (prefixes, local-authority-types, organisations, mandatory, expected, unexpected)
+validation_rules = [
+    (
+        None,
+        None,
+        [
+            "transport-authority:Q682520",  # TfL
+            "transport-authority:Q7834921",  # TfGM
+        ],
+        [],
+        ["opendatacommunities", "billing-authority"],
+        [],
+    ),
+    (
+        ["waste-authority", "transport-authority", "regional-park-authority"],
+        None,
+        None,
+        ["opendatacommunities", "billing-authority"],
+        [],
+        ["statistical-geography"],
+    ),
+    # unable to find URIs for Combined Authorities ..
+    (
+        local_prefixes,
+        ["COMB"],
+        None,
+        ["statistical-geography"],
+        local_fields + ["billing-authority"],
+        [],
+    ),
+    # unable to find URIs for development corporation areas ..
+    (
+        ["development-corporation"],
+        None,
+        None,
+        ["statistical-geography", "opendatacommunities"],
+        local_fields,
+        [],
+    ),
+    # unable to find an area for the GLA ..
+    (
+        local_prefixes,
+        None,
+        ["local-authority-eng:GLA"],
+        ["statistical-geography", "opendatacommunities"],
+        local_fields + ["billing-authority"],
+        [],
+    ),
+    # new authorities, not yet in opendatacommunities ..
+    (
+        local_prefixes,
+        None,
+        [
+            "local-authority-eng:NNUA",
+            "local-authority-eng:NYUA",
+            "local-authority-eng:CUA",
+            "local-authority-eng:WNUA",
+            "local-authority-eng:WFUA",
+            "local-authority-eng:SUA",
+        ],
+        ["statistical-geography"],
+        local_fields + ["billing-authority"],
+        [],
+    ),
+    (
+        local_prefixes,
+        None,
+        None,
+        local_fields,
+        local_fields + ["billing-authority"],
+        [],
+    ),
+]
 
-def has_prefix(organisation, prefixes):
-    return any([organisation.startswith(prefix + ":") for prefix in prefixes])
+# local authorities which aren't expected to have an addressbase custodian code
+addressbase_custodian_exceptions = ["", "COMB", "CTY", "SRA"]
 
+valid_date_pattern = r"^[1-9]\d\d\d-\d\d-\d\d$"
 
-def valid_url(n, url):
-    if url != "" and not validators.url(url):
-        logging.warning("%s: invalid url %s" % (n, url))
-        return True
-    return False
 
+# parts of a url, or None if the url isn't valid,
+# remembered as the same urls are found in many organisations and fields
+@lru_cache(maxsize=65536)
+def parse_url(url):
+    if not validators.url(url):
+        return None
+    return urlsplit(url)
 
-def valid_date(n, date):
-    if date == None or date == "":
-        return False
 
-    if re.match(r"^\d\d\d\d$", date):
-        date = date + "-01"
+# parse each distinct url once
+def parse_urls(urls):
+    return {url: parse_url(url) for url in set(urls) if url}
 
-    if re.match(r"^\d\d\d\d-\d\d$", date):
-        date = date + "-01"
 
+def valid_date(date):
     try:
-        if date == datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d"):
-            return False
+        return date == datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d")
     except ValueError:
-        logging.error("%s: invalid date %s" % (n, date))
-
-    return True
+        return False
 
 
-def valid_statistical_geography(organisation, value):
-    prefix = (
-        organisation.split(":")[0]
-        + ":"
-        + organisations[organisation].get("local-authority-type", "")
+# organisations as a table of strings, one row per organisation
+def organisation_table(organisations):
+    names = sorted(organisations)
+    table = pd.DataFrame(
+        [project(organisations[n]) for n in names],
+        index=pd.Index(names, name="organisation"),
+        columns=fields,
+        dtype=object,
+    )
+    table["organisation"] = table.index
+    return table
+
+
+def result(table, mask, field, severity, message):
+    rows = table.index[mask]
+    if not isinstance(message, str):
+        message = message[mask].values
+    return pd.DataFrame(
+        {
+            "organisation": rows,
+            "field": field,
+            "value": table[field][mask].values if field in table else "",
+            "severity": severity,
+            "message": message,
+        }
     )
-    pattern = {
-        "local-authority-eng:UA": r"^E06000\d\d\d",
-        "local-authority-eng:NMD": r"^E07000\d\d\d",
-        "local-authority-eng:MD": r"^E08000\d\d\d",
-        "local-authority-eng:LBO": r"^E09000\d\d\d",
-        "local-authority-eng:CC": r"^E09000\d\d\d",
-        "local-authority-eng:CTY": r"^E10000\d\d\d",
-        "local-authority-eng:SRA": r"^E12000\d\d\d",
-        "local-authority-eng:COMB": r"^E47000\d\d\d",
-        "national-park-authority:": r"^E260000\d\d",
-        "development-corporation:": r"^E510000\d\d",
-    }
-    if value:
-        if prefix not in pattern:
-            logging.error(
-                "%s: no pattern for statistical-geography %s (%s)"
-                % (organisation, value, prefix)
-            )
-            return True
 
-        if not re.match(pattern[prefix], value):
-            logging.error(
-                "%s: invalid statistical-geography %s (%s)"
-                % (organisation, value, pattern[prefix])
-            )
-            return True
 
-    return False
+# validate every organisation at once, returning a table of the problems found
+def validation_results(organisations):
+    table = organisation_table(organisations)
+    index = table.index.to_series()
+    prefix = index.str.split(":").str[0]
+    local_authority_type = table["local-authority-type"]
+    results = []
+
+    # some validation ..
+    urls = parse_urls(pd.unique(table[url_fields].values.ravel()))
+    for field in url_fields:
+        values = table[field]
+        invalid = (values != "") & values.map(urls).isna()
+        results.append(result(table, invalid, field, "warning", "invalid url " + values))
+
+    for field in date_fields:
+        values = table[field]
+        dates = values.where(~values.str.match(r"^\d\d\d\d$"), values + "-01")
+        dates = dates.where(~dates.str.match(r"^\d\d\d\d-\d\d$"), dates + "-01")
+        valid = dates.str.match(valid_date_pattern)
+        valid[valid] = dates[valid].map({date: valid_date(date) for date in dates[valid].unique()})
+        invalid = (values != "") & ~valid.astype(bool)
+        results.append(result(table, invalid, field, "error", "invalid date " + values))
+
+    # statistical geography
+    values = table["statistical-geography"]
+    key = prefix + ":" + local_authority_type
+    results.append(
+        result(
+            table,
+            (values != "") & ~key.isin(statistical_geography_patterns),
+            "statistical-geography",
+            "error",
+            "no pattern for statistical-geography " + values + " (" + key + ")",
+        )
+    )
+    for k, pattern in statistical_geography_patterns.items():
+        mask = (values != "") & (key == k)
+        mask[mask] = ~values[mask].str.match(pattern)
+        results.append(
+            result(
+                table,
+                mask,
+                "statistical-geography",
+                "error",
+                "invalid statistical-geography " + values + " (" + pattern + ")",
+            )
+        )
+
+    # choose the rule for each active organisation ..
+    active = table["end-date"] == ""
+    rule = pd.Series(-1, index=table.index)
+    for n, (prefixes, types, curies, _, _, _) in reversed(list(enumerate(validation_rules))):
+        mask = active.copy()
+        if prefixes is not None:
+            mask &= prefix.isin(prefixes)
+        if types is not None:
+            mask &= local_authority_type.isin(types)
+        if curies is not None:
+            mask &= index.isin(curies)
+        rule[mask] = n
+
+    # .. and the fields it expects
+    def rule_mask(field, position):
+        numbers = [n for n, r in enumerate(validation_rules) if field in r[position]]
+        return rule.isin(numbers)
+
+    checked = set(mandatory_fields + active_mandatory_fields + ["addressbase-custodian"])
+    for r in validation_rules:
+        checked.update(r[3] + r[4] + r[5])
+
+    for field in sorted(checked):
+        values = table[field] if field in table else pd.Series("", index=table.index)
+        missing = values == ""
+
+        mandatory = rule_mask(field, 3)
+        if field in mandatory_fields:
+            mandatory |= True
+        if field in active_mandatory_fields:
+            mandatory |= active
+        unexpected = rule_mask(field, 5)
+        expected = rule_mask(field, 4)
+        if field == "addressbase-custodian":
+            exception = local_authority_type.isin(addressbase_custodian_exceptions)
+            expected |= active & prefix.isin(local_prefixes) & ~exception
+
+        warning = expected & ~mandatory & ~unexpected & missing
+        results.append(result(table, warning, field, "warning", "missing %s field" % (field)))
+        results.append(
+            result(table, unexpected & ~missing, field, "error", "unexpected field %s" % (field))
+        )
+        error = mandatory & ~unexpected & missing
+        results.append(result(table, error, field, "error", "missing %s field" % (field)))
+
+    results = pd.concat(results, ignore_index=True)
+    return results.sort_values("organisation", kind="stable", ignore_index=True)
 
 
 def validate(organisations):
-    errors = warnings = 0
-    for organisation in sorted(organisations):
-        o = organisations[organisation]
-
-        # some validation ..
-        for url_field in ["opendatacommunities", "opendatacommunities-area", "website"]:
-            if valid_url(organisation, o.get(url_field, "")):
-                warnings += 1
-
-        for date_field in ["start-date", "end-date"]:
-            if valid_date(organisation, o.get(date_field, "")):
-                errors += 1
-
-        # statistical geography
-        if valid_statistical_geography(
-            organisation, o.get("statistical-geography", "")
-        ):
-            errors += 1
-
-        # mandatory fields ..
-        mandatory_fields = set(["entity", "name", "wikidata"])
-        expected_fields = set()
-        unexpected_fields = set()
-
-        # active organisations ..
-        if not o.get("end-date", ""):
-            mandatory_fields.add("website")
-
-            # local government ..
-            if organisation in [
-                "transport-authority:Q682520",  # TfL
-                "transport-authority:Q7834921",  # TfGM
-            ]:
-                expected_fields.update(["opendatacommunities", "billing-authority"])
-            elif has_prefix(
-                organisation,
-                ["waste-authority", "transport-authority", "regional-park-authority"],
-            ):
-                mandatory_fields.update(["opendatacommunities", "billing-authority"])
-                unexpected_fields.add("statistical-geography")
-            elif has_prefix(
-                organisation,
-                [
-                    "local-authority-eng",
-                    "national-park-authority",
-                    "development-corporation",
-                ],
-            ):
-                local_fields = set(
-                    [
-                        "statistical-geography",
-                        "opendatacommunities",
-                        "opendatacommunities-area",
-                    ]
-                )
-                mandatory_fields.update(local_fields)
-                expected_fields.update(local_fields)
-                expected_fields.update(["billing-authority"])
-
-                if o.get("local-authority-type", "") not in ["", "COMB", "CTY", "SRA"]:
-                    expected_fields.update(["addressbase-custodian"])
-
-                # unable to find URIs for Combined Authorities ..
-                if o.get("local-authority-type", "") == "COMB":
-                    mandatory_fields.remove("opendatacommunities")
-                    mandatory_fields.remove("opendatacommunities-area")
-
-                # unable to find URIs for development corporation areas ..
-                elif has_prefix(organisation, ["development-corporation"]):
-                    mandatory_fields.remove("opendatacommunities-area")
-                    expected_fields.remove("billing-authority")
-
-                # unable to find an area for the GLA ..
-                elif organisation in ["local-authority-eng:GLA"]:
-                    mandatory_fields.remove("opendatacommunities-area")
-
-                elif organisation in ["local-authority-eng:NNUA", "local-authority-eng:NYUA", "local-authority-eng:CUA", "local-authority-eng:WNUA", "local-authority-eng:WFUA", "local-authority-eng:SUA"]:
-                    mandatory_fields.remove("opendatacommunities")
-                    mandatory_fields.remove("opendatacommunities-area")
-
-        for field in expected_fields:
-            if field not in set(mandatory_fields).union(unexpected_fields):
-                if not o.get(field, ""):
-                    logging.warning("%s: missing %s field" % (organisation, field))
-                    warnings += 1
-
-        for field in unexpected_fields:
-            if o.get(field, ""):
-                logging.info(o)
-                logging.error("%s: unexpected field %s" % (organisation, field))
-                errors += 1
-
-        for field in mandatory_fields:
-            if field not in unexpected_fields:
-                if not o.get(field, ""):
-                    logging.info(o)
-                    logging.error("%s: missing %s field" % (organisation, field))
-                    errors += 1
-
+    results = validation_results(organisations)
+    for r in results.itertuples(index=False):
+        level = logging.ERROR if r.severity == "error" else logging.WARNING
+        logging.log(level, "%s: %s" % (r.organisation, r.message))
+    errors = int((results["severity"] == "error").sum())
+    warnings = int((results["severity"] == "warning").sum())
     return errors, warnings
 
 
@@ -221,158 +532,695 @@ def csv_path(directory, name):
     return os.path.join(directory, name + ".csv")
 
 
-# add to organisations
-def load_file(path, key=None, prefix=None, fields=None, ignore_ended=False):
-
-    logging.info("loading %s" % (path))
-
-    # construct prefix for curie
-    if prefix is None:
-        prefix = key + ":"
-
-    for row in csv.DictReader(open(path)):
-        if row[key]:
-            curie = prefix + row[key]
-            organisations.setdefault(curie, {})
-
-            for field in row:
-                if field is None:
-                    logging.error("%s: %s has extra columns" % (path, curie))
-                if (not fields) or (field in fields):
-                    to = fields[field] if fields else field
-                    if row[field]:
-                        # stop statistical-geography entries with end-date 
-                        # overriding latest
-                        if ignore_ended and row.get('end-date') is not None:
-                            pass
-                        else:
-                            organisations[curie][to] = row[field]
+# record where the time goes, and which source set each field, for a build
+class Trace:
+    def __init__(self, provenance=True):
+        self.start = time.perf_counter()
+        self.events = []
+        self.provenance = {} if provenance else None
+        self.source = None
+        self.step = False
+        self.written = 0
+
+    def event(self, name, start, **args):
+        self.events.append(
+            {
+                "name": name,
+                "ph": "X",
+                "ts": round((start - self.start) * 1e6),
+                "dur": round((time.perf_counter() - start) * 1e6),
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": args,
+            }
+        )
+
+    # steps which rework values already in place don't replace their source
+    def set_field(self, curie, field):
+        self.written += 1
+        if self.provenance is None:
+            return
+        provenance = self.provenance.setdefault(curie, {})
+        if not (self.step and field in provenance):
+            provenance[field] = self.source
+
+    # the events as a Chrome trace, or as CSV
+    def save(self, path):
+        with open(path, "w", newline="") as f:
+            if not path.endswith(".csv"):
+                json.dump({"traceEvents": self.events}, f, indent=1)
+                return
+            columns = ["name", "seconds", "rows", "matched", "fields"]
+            w = csv.DictWriter(f, columns, extrasaction="ignore")
+            w.writeheader()
+            for e in self.events:
+                w.writerow(dict(e["args"], name=e["name"], seconds=e["dur"] / 1e6))
+
+    def save_provenance(self, path):
+        with open(path, "w", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(["organisation", "field", "source"])
+            for curie in sorted(self.provenance):
+                for field in fields:
+                    if field in self.provenance[curie]:
+                        w.writerow([curie, field, self.provenance[curie][field]])
+
+
+def read_csv(path, trace=None):
+    logging.info("reading %s" % (path))
+    start = time.perf_counter()
+    rows = read_records(path)
+    if trace:
+        trace.event("read " + path, start, rows=len(rows))
+    return rows
+
+
+# the state of a build: the organisations, the organisation curies indexed by field value,
+# maintained as fields are set, the fields kept other than the output fields, as given,
+# and an optional Trace, the instrumentation being off without one
+class Builder:
+    def __init__(self, extra_fields, trace=None):
+        self.organisations = {}
+        self.indexes = {}
+        self.extra_fields = frozenset(extra_fields)
+        self.trace = trace
+
+    # values of fields which are neither output nor kept by this build are dropped
+    def set_field(self, curie, field, value):
+        if field not in field_position and field not in self.extra_fields:
+            return
+        if self.trace:
+            self.trace.set_field(curie, field)
+        o = self.organisations.get(curie, None)
+        if o is None:
+            o = self.organisations[curie] = Organisation()
+        idx = self.indexes.get(field, None)
+        if idx is not None:
+            if field in o:
+                idx[o[field]].pop(curie, None)
+            idx.setdefault(value, {})[curie] = None
+        o[field] = value
+
+    # add to organisations
+    def load_rows(self, path, rows, key=None, prefix=None, fields=None, ignore_ended=False, curies=None):
+
+        logging.info("loading %s" % (path))
+
+        # construct prefix for curie
+        if prefix is None:
+            prefix = key + ":"
+
+        matched = 0
+        for row in rows:
+            if row[key]:
+                curie = prefix + row[key]
+                if curies is not None and curie not in curies:
+                    continue
+                matched += 1
+                if curie not in self.organisations:
+                    self.organisations[curie] = Organisation()
 
+                for field in row:
+                    if field is None:
+                        logging.error("%s: %s has extra columns" % (path, curie))
+                    if (not fields) or (field in fields):
+                        to = fields[field] if fields else field
+                        if row[field]:
+                            # stop statistical-geography entries with end-date 
+                            # overriding latest
+                            if ignore_ended and row.get('end-date') is not None:
+                                pass
+                            else:
+                                self.set_field(curie, to, row[field])
+        return matched
+
+    def load_file(self, path, key=None, prefix=None, fields=None, ignore_ended=False):
+        rows = read_csv(path, self.trace)
+        self.load_rows(path, rows, key=key, prefix=prefix, fields=fields, ignore_ended=ignore_ended)
+
+    # index organisations by key, built once and then kept up to date by set_field
+    def index(self, key):
+        if key not in self.indexes:
+            keys = {}
+            for organisation, o in self.organisations.items():
+                if key in o:
+                    keys.setdefault(o[key], {})
+                    keys[o[key]][organisation] = None
+            self.indexes[key] = keys
+        return self.indexes[key]
+
+    # add to existing organisations
+    def patch_rows(self, path, rows, key):
+        logging.info("patching %s with %s" % (path, key))
+        keys = self.index(key)
+        matched = 0
+        for row in rows:
+            if key in row:
+                if row[key] in keys:
+                    matched += 1
+                for organisation in list(keys.get(row[key], [])):
+                    for field in row:
+                        if row[field] and not self.organisations[organisation].get(field, None):
+                            self.set_field(organisation, field, row[field])
+                            logging.debug([path, key, organisation, field, row[field]])
+        return matched
+
+    def patch_file(self, path, key):
+        self.patch_rows(path, read_csv(path, self.trace), key)
 
+    # assert name from offical-name
+    def assert_name(self):
+        trace = self.trace
+        for organisation, o in self.organisations.items():
+            self.set_field(organisation, "organisation", organisation)
+            self.set_field(organisation, "name", o.get("official-name", o.get("name", "")))
+            if trace and trace.provenance is not None and "official-name" in o:
+                trace.provenance[organisation]["name"] = trace.provenance[organisation]["official-name"]
+
+    # strip blank times from dates
+    def strip_dates(self):
+        for organisation, o in self.organisations.items():
+            for k in o:
+                if k.endswith("-date") or o[k].endswith("T00:00:00Z"):
+                    self.set_field(organisation, k, o[k][:10])
+
+    def apply_stage(self, stage, rows=None, curies=None):
+        (action, path, key, fields, ignore_ended) = stage
+        trace = self.trace
+        if trace:
+            start = time.perf_counter()
+            trace.source = path or action
+            trace.step = path is None
+            written = trace.written
+
+        matched = None
+        if action == "load":
+            matched = self.load_rows(path, rows, key=key, fields=fields, ignore_ended=ignore_ended, curies=curies)
+        elif action == "patch":
+            matched = self.patch_rows(path, rows, key)
+        elif action == "assert-name":
+            self.assert_name()
+        elif action == "strip-dates":
+            self.strip_dates()
+        else:
+            raise ValueError("unknown build stage %s" % (action))
+
+        if trace:
+            name = " ".join([action] + [s for s in [path, key] if s])
+            args = {"fields": trace.written - written}
+            if rows is not None:
+                args.update(rows=len(rows), matched=matched)
+            trace.event(name, start, **args)
+
+
+# build stages, as (action, path, key, fields, ignore_ended)
 def load_register(register, key=None, fields={}, ignore_ended=False):
     key = key or register
-    load_file(csv_path(register_dir, register), key=key, fields=fields, ignore_ended=ignore_ended)
+    return ("load", csv_path(register_dir, register), key, fields, ignore_ended)
 
 
 def load_statistical_geography_register(name):
     register = "statistical-geography-" + name
     fields = {register: "statistical-geography"}
-    load_register(register, key="local-authority-eng", fields=fields, ignore_ended=True)
+    return load_register(register, key="local-authority-eng", fields=fields, ignore_ended=True)
 
 
 def load_data(register, key=None):
     key = key or register
-    load_file(csv_path(data_dir, register), key=key)
-
-
-# index organisations by key
-def index(key):
-    keys = {}
-    for organisation in organisations:
-        if key in organisations[organisation]:
-            keys.setdefault(organisations[organisation][key], [])
-            keys[organisations[organisation][key]].append(organisation)
-    return keys
-
-
-# add to existing organisations
-def patch_file(path, key):
-    logging.info("patching %s with %s" % (path, key))
-    keys = index(key)
-    for row in csv.DictReader(open(path)):
-        if key in row:
-            for organisation in keys.get(row[key], []):
-                for field in row:
-                    if row[field] and not organisations[organisation].get(field, None):
-                        organisations[organisation][field] = row[field]
-                        logging.debug([path, key, organisation, field, row[field]])
+    return ("load", csv_path(data_dir, register), key, None, False)
+
+
+def patch(path, key):
+    return ("patch", path, key, None, False)
 
 
 def patch_register(register, key=None):
     key = key or register
-    patch_file(csv_path(register_dir, register), key=key)
+    return patch(csv_path(register_dir, register), key=key)
 
 
 def patch_wikidata(name, key):
-    patch_file(csv_path("collection/wikidata", name), key)
+    return patch(csv_path("collection/wikidata", name), key)
 
 
 def patch_odc(name, key):
-    patch_file(csv_path("collection/opendatacommunities", name), key)
+    return patch(csv_path("collection/opendatacommunities", name), key)
 
 
 def patch_lookup(name, key):
-    patch_file(csv_path("data/lookup", name), key)
+    return patch(csv_path("data/lookup", name), key)
 
 
-if __name__ == "__main__":
-    logging.basicConfig(
-        level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s"
-    )
+def step(action):
+    return (action, None, None, None, False)
+
 
+# the order of the stages sets the precedence of the data
+stages = [
     # load GOV.UK registers
-    load_register("local-authority-eng")
+    load_register("local-authority-eng"),
 
     # add organisations and data missing from registers
-    load_data("government-organisation")
-    load_data("development-corporation")
-    load_data("local-authority-eng")
-    load_data("local-authority", key="local-authority-eng")
-    load_data("national-park-authority")
-    load_data("regional-park-authority")
-    load_data("transport-authority")
-    load_data("waste-authority")
-    load_data("public-authority")
-    load_data("nonprofit")
+    load_data("government-organisation"),
+    load_data("development-corporation"),
+    load_data("local-authority-eng"),
+    load_data("local-authority", key="local-authority-eng"),
+    load_data("national-park-authority"),
+    load_data("regional-park-authority"),
+    load_data("transport-authority"),
+    load_data("waste-authority"),
+    load_data("public-authority"),
+    load_data("nonprofit"),
 
     # add details for government organisations
-    patch_register("government-organisation")
+    patch_register("government-organisation"),
 
     # statistical geography codes
-    load_statistical_geography_register("county-eng")
-    load_statistical_geography_register("london-borough-eng")
-    load_statistical_geography_register("metropolitan-district-eng")
-    load_statistical_geography_register("non-metropolitan-district-eng")
-    load_statistical_geography_register("unitary-authority-eng")
+    load_statistical_geography_register("county-eng"),
+    load_statistical_geography_register("london-borough-eng"),
+    load_statistical_geography_register("metropolitan-district-eng"),
+    load_statistical_geography_register("non-metropolitan-district-eng"),
+    load_statistical_geography_register("unitary-authority-eng"),
 
-    # assert name from offical-name
-    for organisation, o in organisations.items():
-        o["organisation"] = organisation
-        o["name"] = o.get("official-name", o.get("name", ""))
+    step("assert-name"),
 
     # patch wikidata
-    patch_wikidata("legislature", "wikidata")
-    patch_wikidata("legislature", "name")
-    patch_wikidata("authority", "wikidata")
+    patch_wikidata("legislature", "wikidata"),
+    patch_wikidata("legislature", "name"),
+    patch_wikidata("authority", "wikidata"),
+
+    patch_odc("localgov", "local-authority-eng"),
+    patch_odc("localgov", "billing-authority"),
+    patch_odc("localgov", "name"),
+
+    patch_odc("national-park-authority", "billing-authority"),
+    patch_odc("national-park-authority", "name"),
+
+    patch_odc("development-corporation", "name"),
+
+    patch_odc("admingeo", "opendatacommunities"),
+    patch_odc("admingeo", "statistical-geography"),
+
+    patch_lookup("local-authority-to-region", "organisation"),
+    patch_lookup("local-resilience-forum-to-local-authority", "organisation"),
+    patch_lookup("local-authority-statistical-geography-boundary", "statistical-geography"),
+    patch_lookup("local-authority-to-combined-authority", 'organisation'),
+
+    patch("collection/addressbase-custodian.csv", "organisation"),
+    patch("data/entity.csv", "organisation"),
+    patch("data/government-organisation.csv", "organisation"),
+
+    step("strip-dates"),
+]
+
+
+def source_paths(stages):
+    return list(dict.fromkeys(stage[1] for stage in stages if stage[1]))
+
+
+def read_sources(paths, max_workers=None, trace=None):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(paths, executor.map(lambda path: read_csv(path, trace), paths)))
+
+
+# the fields kept by a build, other than the output fields,
+# including the key of each patch stage, so later stages can match it
+def stage_fields(stages):
+    return extra_fields.union(stage[2] for stage in stages if stage[0] == "patch")
+
+
+# apply the stages in order, optionally only for the given organisations,
+# recording which organisations each patch stage could match,
+# returning the organisations built
+def apply_stages(stages, rows, curies=None, snapshots=None, trace=None):
+    builder = Builder(stage_fields(stages), trace)
+
+    for i, stage in enumerate(stages):
+        if snapshots is not None and stage[0] == "patch":
+            snapshots[i] = {v: list(keys) for v, keys in builder.index(stage[2]).items()}
+        builder.apply_stage(stage, rows.get(stage[1], None), curies)
+    return builder.organisations
+
+
+# build the organisations from the stages:
+# reading and parsing the source files doesn't depend upon any other stage, so
+# each file is read once, concurrently, then the stages are applied in order.
+# each build returns organisations of its own
+def build(stages=stages, max_workers=None, trace=None):
+    rows = read_sources(source_paths(stages), max_workers, trace)
+    return apply_stages(stages, rows, trace=trace)
+
+
+# the code the build depends upon
+builder_paths = [__file__] + [
+    os.path.join(os.path.dirname(__file__), name) for name in ["csvload.py", "identifiers.py"]
+]
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def save_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(manifest, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+# organisations which may be changed by rows from a changed source:
+# an organisation only ever takes values from the rows which load it by its curie,
+# or which match its key value when a patch stage is applied
+def touched(stages, snapshots, changed, old_rows, new_rows):
+    curies = set()
+    for i, stage in enumerate(stages):
+        (action, path, key, fields, ignore_ended) = stage
+        if path not in changed:
+            continue
+        rows = old_rows.get(path, []) + new_rows.get(path, [])
+        if action == "load":
+            curies.update(key + ":" + row[key] for row in rows if row.get(key))
+        elif action == "patch":
+            for value in set(row[key] for row in rows if key in row):
+                curies.update(snapshots[i].get(value, []))
+    return curies
+
+
+# rebuild the given organisations, keeping the others as they are in old,
+# and update the snapshots of the patch stages to match
+def rebuild(stages, rows, curies, snapshots, old, trace=None):
+    partial = {}
+    rebuilt = apply_stages(stages, rows, curies=curies, snapshots=partial, trace=trace)
+
+    for i, snapshot in snapshots.items():
+        for value in list(snapshot):
+            keys = [k for k in snapshot[value] if k not in curies]
+            if keys:
+                snapshot[value] = keys
+            else:
+                del snapshot[value]
+        for value, keys in partial[i].items():
+            snapshot.setdefault(value, []).extend(keys)
+
+    organisations = {k: o for k, o in old.items() if k not in curies}
+    organisations.update(rebuilt)
+    return organisations
+
+
+# rebuild only the organisations touched by sources which have changed since the
+# build recorded in the manifest, returning the changed records as (old, new) pairs
+def build_incremental(manifest_path, stages=stages, max_workers=None, trace=None):
+    paths = source_paths(stages)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        hashes = dict(zip(paths, executor.map(file_hash, paths)))
+
+    # any change to the stages or to the code building them needs a full build
+    builder = [file_hash(path) for path in builder_paths]
+
+    manifest = load_manifest(manifest_path)
+    if manifest is not None and (manifest["builder"] != builder or manifest["stages"] != stages):
+        manifest = None
+
+    # a trace is of every organisation, so also needs a full build,
+    # with the changes still being from the build recorded in the manifest
+    if manifest is None or trace:
+        logging.info("full build")
+        old = manifest["organisations"] if manifest else {}
+        sources = {}
+        snapshots = {}
+        rows = read_sources(paths, max_workers, trace)
+        organisations = apply_stages(stages, rows, snapshots=snapshots, trace=trace)
+    else:
+        old = manifest["organisations"]
+        sources = manifest["sources"]
+        snapshots = manifest["snapshots"]
+        changed = [path for path in paths if sources.get(path, {}).get("hash") != hashes[path]]
+        logging.info("changed sources: %s" % (changed))
+
+        old_rows = {path: sources[path]["rows"] for path in changed if path in sources}
+        rows = {path: sources[path]["rows"] for path in paths if path not in changed}
+        rows.update(read_sources(changed, max_workers, trace))
+
+        curies = touched(stages, snapshots, set(changed), old_rows, rows)
+        logging.info("rebuilding %d organisations" % (len(curies)))
+        organisations = rebuild(stages, rows, curies, snapshots, old, trace)
+
+    changes = {}
+    for curie in set(old).union(organisations):
+        o = old.get(curie, None)
+        n = organisations.get(curie, None)
+        if o != n:
+            changes[curie] = (o, n)
+
+    save_manifest(
+        manifest_path,
+        {
+            "builder": builder,
+            "stages": stages,
+            "sources": {path: {"hash": hashes[path], "rows": rows[path]} for path in paths},
+            "snapshots": snapshots,
+            "organisations": organisations,
+        },
+    )
+    return organisations, changes
+
+
+# write the changed organisations, with how each has changed
+def save_changes(changes, f=None):
+    w = csv.DictWriter(f or sys.stdout, ["change"] + fields, extrasaction="ignore")
+    w.writeheader()
+    for organisation in sorted(changes):
+        (o, n) = changes[organisation]
+        if o is None:
+            w.writerow(dict(n, change="added"))
+        elif n is None:
+            w.writerow(dict(o, change="removed"))
+        elif any(o.get(field, "") != n.get(field, "") for field in fields):
+            w.writerow(dict(n, change="changed"))
+
+
+# the dates a row is in effect, from its start-date up to, but not including, its end-date
+def row_dates(row):
+    return ((row.get("start-date") or "")[:10], (row.get("end-date") or "")[:10])
+
+
+def in_effect(row, date):
+    (start, end) = row_dates(row)
+    return start <= date and (not end or date < end)
+
+
+# the history of the organisations, as an interval index:
+# for each organisation, the dates on which its record changed,
+# and its record from that date until the next, or None while it didn't exist
+class History:
+    def __init__(self, lifetimes=None):
+        self.dates = {}
+        self.records = {}
+        self.lifetimes = lifetimes or {}
+
+    def record(self, date, curie, o):
+        values = tuple(project(o)) if o is not None else None
+        records = self.records.setdefault(curie, [])
+        if (records and records[-1] == values) or (not records and values is None):
+            return
+        self.dates.setdefault(curie, []).append(date)
+        records.append(values)
+
+    # an organisation exists between the start-date and end-date it has now
+    def alive(self, curie, date):
+        (start, end) = self.lifetimes.get(curie, ("", ""))
+        return start <= date and (not end or date < end)
+
+    def values(self, curie, date):
+        dates = self.dates.get(curie, None)
+        if not dates or not self.alive(curie, date):
+            return None
+        i = bisect_right(dates, date) - 1
+        return self.records[curie][i] if i >= 0 else None
+
+    # the organisation as it was on the date, or None
+    def state(self, curie, date):
+        values = self.values(curie, date)
+        if values is None:
+            return None
+        return Organisation((field, value) for field, value in zip(fields, values) if value)
+
+    # every organisation as it was on the date, in one pass over the index
+    def snapshot(self, date):
+        snapshot = {}
+        for curie in self.dates:
+            o = self.state(curie, date)
+            if o is not None:
+                snapshot[curie] = o
+        return snapshot
+
+    # the (start-date, end-date, value) intervals of a field of an organisation,
+    # within the lifetime of the organisation, an empty date being unbounded
+    def intervals(self, curie, field):
+        position = field_position[field]
+        dates = self.dates.get(curie, [])
+        intervals = []
+        for date, values in zip(dates, self.records.get(curie, [])):
+            value = values[position] if values is not None else ""
+            if intervals and intervals[-1][2] == value:
+                continue
+            if intervals:
+                intervals[-1][1] = date
+            intervals.append([date, "", value])
+
+        (born, died) = self.lifetimes.get(curie, ("", ""))
+        clipped = []
+        for (start, end, value) in intervals:
+            start = max(start, born)
+            if died and (not end or died < end):
+                end = died
+            if value and (not end or start < end):
+                clipped.append((start, end, value))
+        return clipped
+
+    def save(self, f=None):
+        w = csv.writer(f or sys.stdout)
+        w.writerow(["organisation", "field", "start-date", "end-date", "value"])
+        for curie in sorted(self.dates):
+            for field in fields:
+                for (start, end, value) in self.intervals(curie, field):
+                    w.writerow([curie, field, start, end, value])
+
+
+# build the history of the organisations, from each row being in effect between
+# its start-date and end-date, in place of ignoring rows which have ended:
+# starting with the rows without a start-date, the organisations touched by rows
+# starting or ending on each date are rebuilt, as by an incremental build
+def build_history(stages=stages, max_workers=None, trace=None):
+    rows = read_sources(source_paths(stages), max_workers, trace)
+
+    # the lifetime of each organisation is taken from the dataset as it is built now
+    organisations = apply_stages(stages, rows, trace=trace)
+    history = History(
+        {
+            curie: (o.get("start-date", "")[:10], o.get("end-date", "")[:10])
+            for curie, o in organisations.items()
+        }
+    )
+
+    stages = [(action, path, key, fields, False) for (action, path, key, fields, ignore_ended) in stages]
+    starting = {}
+    ending = {}
+    for path, path_rows in rows.items():
+        for row in path_rows:
+            (start, end) = row_dates(row)
+            if end and end <= start:
+                continue
+            if start:
+                starting.setdefault(start, {}).setdefault(path, []).append(row)
+            if end:
+                ending.setdefault(end, {}).setdefault(path, []).append(row)
+
+    current = {path: [row for row in path_rows if in_effect(row, "")] for path, path_rows in rows.items()}
+    snapshots = {}
+    state = apply_stages(stages, current, snapshots=snapshots, trace=trace)
+    for curie, o in state.items():
+        history.record("", curie, o)
+
+    for date in sorted(set(starting).union(ending)):
+        changed = set(starting.get(date, {})).union(ending.get(date, {}))
+        for path in changed:
+            current[path] = [row for row in rows[path] if in_effect(row, date)]
+
+        curies = touched(stages, snapshots, changed, ending.get(date, {}), starting.get(date, {}))
+        state = rebuild(stages, current, curies, snapshots, state, trace)
+        for curie in curies:
+            history.record(date, curie, state.get(curie, None))
+
+    return history
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    parser = argparse.ArgumentParser(description="build the organisation dataset")
+    parser.add_argument(
+        "--manifest",
+        help="rebuild only the organisations touched by sources changed since the build recorded in this file",
+    )
+    parser.add_argument(
+        "--diff",
+        action="store_true",
+        help="write the changed organisations rather than the whole dataset",
+    )
+    parser.add_argument(
+        "--shards",
+        help="also save a file for each organisation prefix to this directory",
+    )
+    parser.add_argument(
+        "--sqlite",
+        help="also save the organisations as a typed and indexed SQLite database",
+    )
+    parser.add_argument(
+        "--as-of",
+        help="write the organisations as they were on this date, from the history of the sources",
+    )
+    parser.add_argument(
+        "--history",
+        help="save the dates between which each field of each organisation had each value as CSV",
+    )
+    parser.add_argument(
+        "--trace",
+        help="save the time, rows read and matched, and fields written by each stage, as a Chrome trace, or CSV if the file ends .csv",
+    )
+    parser.add_argument(
+        "--provenance",
+        help="save the source which set each field of each organisation as CSV",
+    )
+    args = parser.parse_args()
 
-    patch_odc("localgov", "local-authority-eng")
-    patch_odc("localgov", "billing-authority")
-    patch_odc("localgov", "name")
+    trace = Trace() if args.trace or args.provenance else None
 
-    patch_odc("national-park-authority", "billing-authority")
-    patch_odc("national-park-authority", "name")
+    if args.as_of or args.history:
+        history = build_history(trace=trace)
+        if args.history:
+            with open(args.history, "w", newline="") as f:
+                history.save(f)
 
-    patch_odc("development-corporation", "name")
+    if args.as_of:
+        organisations = history.snapshot(args.as_of)
+        changes = {organisation: (None, o) for organisation, o in organisations.items()}
+    elif args.manifest:
+        organisations, changes = build_incremental(args.manifest, trace=trace)
+    else:
+        organisations = build(trace=trace)
+        changes = {organisation: (None, o) for organisation, o in organisations.items()}
 
-    patch_odc("admingeo", "opendatacommunities")
-    patch_odc("admingeo", "statistical-geography")
+    if args.diff:
+        save_changes(changes)
+    else:
+        save(organisations)
 
-    patch_lookup("local-authority-to-region", "organisation")
-    patch_lookup("local-resilience-forum-to-local-authority", "organisation")
-    patch_lookup("local-authority-statistical-geography-boundary", "statistical-geography")
-    patch_lookup("local-authority-to-combined-authority", 'organisation')
+    if args.shards:
+        save_shards(organisations, args.shards)
 
-    patch_file("collection/addressbase-custodian.csv", "organisation")
-    patch_file("data/entity.csv", "organisation")
-    patch_file("data/government-organisation.csv", "organisation")
+    if args.sqlite:
+        save_sqlite(organisations, args.sqlite)
 
-    for organisation, o in organisations.items():
-        # strip blank times from dates
-        for k in o:
-            if k.endswith("-date") or o[k].endswith("T00:00:00Z"):
-                o[k] = o[k][:10]
+    if args.trace:
+        trace.save(args.trace)
 
-    save(organisations)
+    if args.provenance:
+        trace.save_provenance(args.provenance)
 
     errors, warnings = validate(organisations)
 
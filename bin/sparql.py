@@ -1,25 +1,112 @@
 #!/usr/bin/env python3
 
-# run a SPARQL query, results as canonical CSV
+# run SPARQL queries, results as canonical CSV
 
+import os
+import re
 import sys
-from sys import argv
-from SPARQLWrapper import SPARQLWrapper, JSON
 import csv
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+import requests
+from glob import glob
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-names = {}
-prefix = ""
+agent = "Mozilla/5.0 (Windows NT 5.1; rv:36.0) Gecko/20100101 Firefox/36.0"
 
+sparql_dir = "sparql/"
+collection_dir = "collection/"
+cache_dir = ".cache/sparql/"
 
-def sparql(endpoint, query):
-    s = SPARQLWrapper(
-        endpoint,
-        agent="Mozilla/5.0 (Windows NT 5.1; rv:36.0) Gecko/20100101 Firefox/36.0",
+# endpoint, and prefix removed from values, for each directory of queries
+endpoints = {
+    "wikidata": ("https://query.wikidata.org/sparql", "http://www.wikidata.org/entity/"),
+    "opendatacommunities": ("https://opendatacommunities.org/sparql", None),
+}
+
+# one session, and pool of connections, for each endpoint
+sessions = {}
+sessions_lock = threading.Lock()
+
+
+def session(endpoint, pool_size=10):
+    with sessions_lock:
+        if endpoint not in sessions:
+            s = requests.Session()
+            s.headers.update(
+                {"User-Agent": agent, "Accept": "application/sparql-results+json"}
+            )
+            retry = Retry(
+                total=5,
+                backoff_factor=1,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=["GET", "POST"],
+            )
+            s.mount(
+                endpoint,
+                HTTPAdapter(
+                    max_retries=retry, pool_connections=1, pool_maxsize=pool_size
+                ),
+            )
+            sessions[endpoint] = s
+        return sessions[endpoint]
+
+
+def cache_path(endpoint, query):
+    key = hashlib.sha256((endpoint + "\n" + query).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, key + ".json")
+
+
+# results of a query, from the cache if they are less than ttl seconds old,
+# only cached when they may be reused
+def sparql(endpoint, query, ttl=0):
+    path = cache_path(endpoint, query)
+    if ttl and os.path.exists(path) and time.time() - os.path.getmtime(path) < ttl:
+        with open(path) as f:
+            return json.load(f)
+
+    r = session(endpoint).post(endpoint, data={"query": query})
+    r.raise_for_status()
+    data = r.json()
+    if not ttl:
+        return data
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = "%s.%d.tmp" % (path, threading.get_ident())
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+    return data
+
+
+# queries already limited, or without an order, are fetched in one page
+def pageable(query):
+    return re.search(r"\bORDER\s+BY\b", query, re.I) and not re.search(
+        r"\b(LIMIT|OFFSET)\b", query, re.I
     )
 
-    s.setQuery(query)
-    s.setReturnFormat(JSON)
-    return s.query().convert()
+
+# results of a query, a page at a time
+def pages(endpoint, query, page_size=None, ttl=0):
+    if not page_size or not pageable(query):
+        yield sparql(endpoint, query, ttl)
+        return
+
+    offset = 0
+    while True:
+        data = sparql(
+            endpoint, "%s\nLIMIT %d OFFSET %d" % (query, page_size, offset), ttl
+        )
+        yield data
+        if len(data["results"]["bindings"]) < page_size:
+            break
+        offset += page_size
 
 
 def remove_prefix(value, prefix):
@@ -28,24 +115,111 @@ def remove_prefix(value, prefix):
     return value
 
 
-if __name__ == "__main__":
-    # usage: sparql.py endpoint-url sparql-files [removed-prefix]
-    data = sparql(argv[1], open(argv[2]).read())
+# write the results to a file as each page arrives
+def save(f, endpoint, query, prefix=None, page_size=None, ttl=0):
+    w = None
+    count = 0
+    for data in pages(endpoint, query, page_size, ttl):
+        if w is None:
+            fields = [field.replace("_", "-") for field in data["head"]["vars"]]
+            w = csv.DictWriter(f, fields, extrasaction="ignore")
+            w.writeheader()
+
+        for o in data["results"]["bindings"]:
+            row = {}
+            for field in fields:
+                var = field.replace("-", "_")
+                if var in o:
+                    value = o[var]["value"]
+                    row[field] = remove_prefix(value, prefix)
+
+            w.writerow(row)
+            count += 1
+    return count
 
-    if len(argv) > 3:
-        prefix = argv[3]
 
-    fields = [field.replace("_", "-") for field in data["head"]["vars"]]
+# run a query file into collection/<endpoint-name>/<query-name>.csv
+def collect(path, page_size=None, ttl=0):
+    name = os.path.basename(os.path.dirname(path))
+    (endpoint, prefix) = endpoints[name]
+    output = os.path.join(
+        collection_dir, name, os.path.splitext(os.path.basename(path))[0] + ".csv"
+    )
+
+    start = time.perf_counter()
+    with open(path) as f:
+        query = f.read()
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    tmp = output + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            count = save(f, endpoint, query, prefix, page_size, ttl)
+        os.replace(tmp, output)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    logging.info(
+        "%s: %d rows in %.1fs" % (output, count, time.perf_counter() - start)
+    )
+    return output
+
+
+# run every query under the sparql directory, one failure doesn't stop the others
+def collect_all(page_size=None, ttl=0, max_workers=None):
+    paths = sorted(
+        path
+        for name in endpoints
+        for path in glob(os.path.join(sparql_dir, name, "*.rq"))
+    )
 
-    w = csv.DictWriter(sys.stdout, fields, extrasaction="ignore")
-    w.writeheader()
+    def run(path):
+        try:
+            collect(path, page_size, ttl)
+            return None
+        except Exception as e:
+            logging.error("%s: %s" % (path, e))
+            return path
 
-    for o in data["results"]["bindings"]:
-        row = {}
-        for field in fields:
-            f = field.replace("-", "_")
-            if f in o:
-                value = o[f]["value"]
-                row[field] = remove_prefix(value, prefix)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return [path for path in executor.map(run, paths) if path]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    parser = argparse.ArgumentParser(description="run SPARQL queries as CSV")
+    parser.add_argument("endpoint", nargs="?", help="endpoint URL")
+    parser.add_argument("query", nargs="?", help="file containing the query")
+    parser.add_argument("prefix", nargs="?", help="prefix removed from values")
+    parser.add_argument(
+        "--collect",
+        action="store_true",
+        help="run every query under %s concurrently into %s" % (sparql_dir, collection_dir),
+    )
+    parser.add_argument(
+        "--page-size", type=int, default=10000, help="rows to fetch in each request"
+    )
+    parser.add_argument(
+        "--ttl",
+        type=int,
+        default=0,
+        help="seconds to reuse results cached in %s" % (cache_dir),
+    )
+    parser.add_argument("--workers", type=int, help="queries to run at once")
+    args = parser.parse_args()
 
-        w.writerow(row)
+    if args.collect:
+        failed = collect_all(args.page_size, args.ttl, args.workers)
+        if failed:
+            logging.error("%d queries failed" % (len(failed)))
+            sys.exit(2)
+    elif args.endpoint and args.query:
+        with open(args.query) as f:
+            query = f.read()
+        save(sys.stdout, args.endpoint, query, args.prefix, args.page_size, args.ttl)
+    else:
+        parser.error("an endpoint and query, or --collect, are needed")
@@ -0,0 +1,141 @@
+import json
+
+import pytest
+
+import collect_ons_data
+from collect_ons_data import GeoJSONReader
+
+features = [
+    {
+        "type": "Feature",
+        "properties": {"LAD21CD": "E06000001", "LAD21NM": 'Hartlepool {"[x]"} \\ é ☃', "n": i, "f": -1.5e3},
+        "geometry": {"type": "Polygon", "coordinates": [[[-1.2, 54.6], [-1.3, 54.7], [-1.2, 54.6]]]},
+    }
+    for i in range(3)
+] + [{"type": "Feature", "properties": {"ok": True, "none": None}, "geometry": None}]
+
+document = {
+    "type": "FeatureCollection",
+    "name": "Local_Authority_Districts",
+    "crs": {"type": "name", "properties": {"name": "urn:ogc:def:crs:OGC:1.3:CRS84"}},
+    "bbox": [-1.3, 54.6, -1.2, 54.7],
+    "features": features,
+    "exceededTransferLimit": False,
+}
+
+
+def chunked(data, size):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1 << 16])
+def test_geojson_reader(size):
+    data = json.dumps(document, ensure_ascii=False, indent=1).encode("utf-8")
+    assert list(GeoJSONReader(chunked(data, size))) == features
+
+
+def test_geojson_reader_empty_features():
+    assert list(GeoJSONReader([b'{"type": "FeatureCollection", "features": []}'])) == []
+
+
+def test_geojson_reader_truncated():
+    data = json.dumps(document).encode("utf-8")
+    with pytest.raises(ValueError):
+        list(GeoJSONReader(chunked(data[:-100], 10)))
+
+
+def geojson(features):
+    return json.dumps({"type": "FeatureCollection", "features": features}).encode("utf-8")
+
+
+@pytest.fixture
+def collection(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "collection").mkdir()
+    return tmp_path / "collection"
+
+
+def vintage(server):
+    return ("Local Authority Districts", server.url + "/query", "https://example.com/lad")
+
+
+def test_collect_dataset_not_modified(serve, collection):
+    (collection / "lad.geojson").write_bytes(geojson(features))
+    server = serve(lambda request: (304, {"ETag": '"v1"'}, b""))
+    validators = {server.url + "/query": {"etag": '"v1"', "last-modified": None}}
+
+    report = collect_ons_data.collect_dataset(vintage(server), validators)
+
+    assert report["status"] == "not-modified"
+    assert server.requests[0].headers["If-None-Match"] == '"v1"'
+    assert json.loads((collection / "lad.geojson").read_bytes())["features"] == features
+
+
+def test_collect_dataset_replaced(serve, collection):
+    (collection / "lad.geojson").write_bytes(geojson(features[:1]))
+    server = serve(lambda request: (200, {"ETag": '"v2"'}, geojson(features)))
+    validators = {server.url + "/query": {"etag": '"v1"', "last-modified": None}}
+
+    report = collect_ons_data.collect_dataset(vintage(server), validators)
+
+    assert report["status"] == "fetched"
+    assert report["bytes"] == len(geojson(features))
+    assert json.loads((collection / "lad.geojson").read_bytes())["features"] == features
+    assert validators[server.url + "/query"]["etag"] == '"v2"'
+    assert sorted(p.name for p in collection.iterdir()) == ["lad.geojson"]
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        (500, {}, b"unavailable"),
+        (200, {}, geojson(features)[:-50]),
+    ],
+)
+def test_collect_dataset_failed(serve, collection, response):
+    (collection / "lad.geojson").write_bytes(geojson(features[:1]))
+    server = serve(lambda request: response)
+    validators = {server.url + "/query": {"etag": '"v1"', "last-modified": None}}
+
+    report = collect_ons_data.collect_dataset(vintage(server), validators)
+
+    assert report["status"] == "failed"
+    assert json.loads((collection / "lad.geojson").read_bytes())["features"] == features[:1]
+    assert validators[server.url + "/query"]["etag"] == '"v1"'
+    assert sorted(p.name for p in collection.iterdir()) == ["lad.geojson"]
+
+
+def test_build_dataset_from_newest_vintage(collection):
+    def feature(code, name):
+        return {"type": "Feature", "properties": {"LAD21CD": code, "LAD21NM": name}, "geometry": None}
+
+    (collection / "lad-2019.geojson").write_bytes(
+        geojson([feature("E07000004", "Aylesbury Vale"), feature("E06000001", "Hartlepool")])
+    )
+    (collection / "lad-2021.geojson").write_bytes(
+        geojson([feature("E06000060", "Buckinghamshire"), feature("E06000001", "Hartlepool")])
+    )
+    dataset = (
+        "local-authority-district",
+        [("statistical-geography", "LADYYCD", False), ("name", "LADYYNM", False)],
+        "lad.csv",
+        [
+            ("LAD (2019)", "https://example.com/2019", "https://example.com/lad-2019"),
+            ("LAD (2021)", "https://example.com/2021", "https://example.com/lad-2021"),
+        ],
+    )
+
+    report = collect_ons_data.build_dataset(dataset)
+
+    assert report["rows"] == 2
+    assert open("lad.csv").read().splitlines() == [
+        "statistical-geography,name",
+        "E06000060,Buckinghamshire",
+        "E06000001,Hartlepool",
+    ]
+
+
+def test_empty_registries(collection):
+    assert collect_ons_data.collect_datasets([]) == []
+    assert collect_ons_data.build_datasets([]) == []
+    collect_ons_data.map_lookups([], {})
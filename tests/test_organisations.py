@@ -0,0 +1,5 @@
+import organisations
+
+
+def test_validate_empty():
+    assert organisations.validate({}) == (0, 0)
@@ -0,0 +1,145 @@
+import io
+import os
+import re
+import json
+from urllib.parse import parse_qs
+
+import pytest
+import requests
+
+import sparql
+
+prefix = "http://www.wikidata.org/entity/"
+query = "SELECT ?item ?local_authority WHERE { ?item wdt:P31 ?local_authority } ORDER BY ?item"
+
+
+def results(bindings):
+    data = {"head": {"vars": ["item", "local_authority"]}, "results": {"bindings": bindings}}
+    return 200, {"Content-Type": "application/sparql-results+json"}, json.dumps(data).encode()
+
+
+def binding(n):
+    return {
+        "item": {"type": "uri", "value": prefix + "Q%d" % (n)},
+        "local_authority": {"type": "literal", "value": "E0600000%d" % (n)},
+    }
+
+
+def posted_query(request):
+    return parse_qs(request.body.decode())["query"][0]
+
+
+# answer each query with the page of rows its LIMIT and OFFSET ask for
+def paged(rows):
+    def respond(request):
+        m = re.search(r"LIMIT (\d+) OFFSET (\d+)$", posted_query(request))
+        (limit, offset) = (int(m.group(1)), int(m.group(2))) if m else (len(rows), 0)
+        return results([binding(n) for n in rows[offset : offset + limit]])
+
+    return respond
+
+
+@pytest.fixture(autouse=True)
+def isolated(tmp_path, monkeypatch):
+    monkeypatch.setattr(sparql, "sessions", {})
+    monkeypatch.setattr(sparql, "cache_dir", str(tmp_path / "sparql"))
+
+
+def test_pageable():
+    assert sparql.pageable(query)
+    assert not sparql.pageable(query + " LIMIT 5")
+    assert not sparql.pageable("SELECT ?item WHERE { ?item wdt:P31 ?type }")
+
+
+def test_save_pages(serve):
+    server = serve(paged(list(range(25))))
+    f = io.StringIO()
+
+    count = sparql.save(f, server.url, query, prefix, page_size=10)
+
+    assert count == 25
+    assert [posted_query(r).split("\n")[-1] for r in server.requests] == [
+        "LIMIT 10 OFFSET 0",
+        "LIMIT 10 OFFSET 10",
+        "LIMIT 10 OFFSET 20",
+    ]
+    lines = f.getvalue().splitlines()
+    assert lines[0] == "item,local-authority"
+    assert lines[1] == "Q0,E06000000"
+    assert len(lines) == 26
+
+
+def test_save_unpageable_query_in_one_request(serve):
+    server = serve(paged(list(range(25))))
+    f = io.StringIO()
+
+    count = sparql.save(f, server.url, query + "\nLIMIT 100", prefix, page_size=10)
+
+    assert count == 25
+    assert len(server.requests) == 1
+
+
+def test_retry_with_backoff(serve, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("urllib3.util.retry.time.sleep", sleeps.append)
+    responses = [(503, {}, b"busy"), (503, {}, b"busy"), results([binding(1)])]
+    server = serve(lambda request: responses.pop(0))
+
+    data = sparql.sparql(server.url, query)
+
+    assert len(server.requests) == 3
+    assert data["results"]["bindings"] == [binding(1)]
+    assert sleeps == [2.0]
+
+
+def test_no_retry_on_client_error(serve):
+    server = serve(lambda request: (400, {}, b"bad query"))
+
+    with pytest.raises(requests.HTTPError):
+        sparql.sparql(server.url, query)
+    assert len(server.requests) == 1
+
+
+def test_cache_reused_within_ttl(serve):
+    server = serve(paged([1, 2]))
+
+    first = sparql.sparql(server.url, query, ttl=60)
+    second = sparql.sparql(server.url, query, ttl=60)
+
+    assert first == second
+    assert len(server.requests) == 1
+
+
+def test_cache_expires_after_ttl(serve):
+    server = serve(paged([1, 2]))
+
+    sparql.sparql(server.url, query, ttl=60)
+    path = sparql.cache_path(server.url, query)
+    os.utime(path, (0, 0))
+    sparql.sparql(server.url, query, ttl=60)
+
+    assert len(server.requests) == 2
+
+
+def test_no_cache_without_ttl(serve):
+    server = serve(paged([1, 2]))
+
+    sparql.sparql(server.url, query)
+    sparql.sparql(server.url, query)
+
+    assert len(server.requests) == 2
+    assert not os.path.exists(sparql.cache_path(server.url, query))
+
+
+def test_collect_failure_leaves_no_temporary_file(serve, tmp_path, monkeypatch):
+    server = serve(lambda request: (400, {}, b"bad query"))
+    monkeypatch.setattr(sparql, "endpoints", {"wikidata": (server.url, prefix)})
+    monkeypatch.setattr(sparql, "sparql_dir", str(tmp_path / "sparql-queries"))
+    monkeypatch.setattr(sparql, "collection_dir", str(tmp_path / "collection"))
+    (tmp_path / "sparql-queries" / "wikidata").mkdir(parents=True)
+    (tmp_path / "sparql-queries" / "wikidata" / "authority.rq").write_text(query)
+
+    failed = sparql.collect_all()
+
+    assert [os.path.basename(path) for path in failed] == ["authority.rq"]
+    assert os.listdir(tmp_path / "collection" / "wikidata") == []